@@ -0,0 +1,62 @@
+"""
+Compare two result files written by run.py.
+
+    python benchmarks/compare.py benchmarks/results/old.json benchmarks/results/new.json
+
+Exits with status 1 when any route got slower (p50 or p99) or ran more SQL
+statements than the allowed threshold. A metric that was 0 in the baseline
+regresses as soon as it grows at all.
+"""
+import argparse
+import json
+import sys
+
+METRICS = ('p50_ms', 'p99_ms', 'statements_mean')
+
+
+def relative_change(old, new):
+    if old:
+        return (new - old) / old
+    # from 0 any increase is unbounded: a route that ran no SQL now does
+    return float('inf') if new > old else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=0.10, help='allowed relative slowdown (default 10%%)')
+    args = parser.parse_args()
+
+    with open(args.baseline) as fp:
+        baseline = json.load(fp)
+    with open(args.candidate) as fp:
+        candidate = json.load(fp)
+
+    if baseline['volumes'] != candidate['volumes']:
+        print('warning: the runs used different volumes: %s vs %s' % (baseline['volumes'], candidate['volumes']))
+
+    print('%-26s %-16s %10s %10s %8s' % ('route', 'metric', baseline['commit'], candidate['commit'], 'change'))
+    regressions = []
+    for endpoint in sorted(set(baseline['results']) & set(candidate['results'])):
+        old = baseline['results'][endpoint]['sequential']
+        new = candidate['results'][endpoint]['sequential']
+        for metric in METRICS:
+            if metric not in old or metric not in new:
+                continue
+            change = relative_change(old[metric], new[metric])
+            flag = ''
+            # latency is noisy below a millisecond; statement counts are exact
+            if change > args.threshold and (metric == 'statements_mean' or new[metric] - old[metric] > 1):
+                flag = '  <-- regression'
+                regressions.append((endpoint, metric))
+            shown = '%+7.1f%%' % (change * 100) if change != float('inf') else '%8s' % 'from 0'
+            print('%-26s %-16s %10.2f %10.2f %s%s' % (endpoint, metric, old[metric], new[metric], shown, flag))
+
+    if regressions:
+        print('%d regression(s)' % len(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
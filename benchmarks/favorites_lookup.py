@@ -0,0 +1,98 @@
+"""
+Lookup cost on the favorites tables with and without the favorites indexes.
+
+    python benchmarks/favorites_lookup.py --rows 1000000
+
+Builds a throwaway SQLite database (or uses --db-url) with --rows favorite
+planets spread over --users users, then times the two queries the API runs
+against that table: the duplicate check of a single (user, planet) pair and the
+listing of one user's favorites.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from sqlalchemy import create_engine, insert, select, text  # noqa: E402
+from models import db, User, Planets, Favorites_Planets  # noqa: E402
+
+INDEX_NAMES = ('ix_favorites__planets_user_id_planet_fav_id', 'ix_favorites__planets_planet_fav_id')
+
+
+def seed(engine, rows, users, planets):
+    db.metadata.create_all(engine, tables=[User.__table__, Planets.__table__, Favorites_Planets.__table__])
+    with engine.begin() as conn:
+        conn.execute(insert(User), [
+            {'id': i, 'user_name': 'user%d' % i, 'email': 'user%d@example.com' % i, 'password': 'x'}
+            for i in range(1, users + 1)
+        ])
+        conn.execute(insert(Planets), [
+            {'id': i, 'planet_name': 'planet%d' % i, 'rotation_period': '1', 'orbital_period': '1',
+             'diameter': '1', 'climate': 'arid', 'gravity': '1', 'terrain': 'desert',
+             'surface_water': '1', 'population': '1'}
+            for i in range(1, planets + 1)
+        ])
+        # every user gets rows / users distinct planets, so the unique index holds
+        per_user = rows // users
+        batch = []
+        for user_id in range(1, users + 1):
+            for planet_id in random.sample(range(1, planets + 1), per_user):
+                batch.append({'user_id': user_id, 'planet_fav_id': planet_id})
+            if len(batch) >= 50000:
+                conn.execute(insert(Favorites_Planets), batch)
+                batch = []
+        if batch:
+            conn.execute(insert(Favorites_Planets), batch)
+
+
+def timed(conn, stmt, params, repeat):
+    start = time.perf_counter()
+    for values in params[:repeat]:
+        conn.execute(stmt, values).all()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def measure(engine, users, planets, repeat):
+    pair = select(Favorites_Planets.id).where(
+        Favorites_Planets.user_id == text(':user_id'), Favorites_Planets.planet_fav_id == text(':planet_id'))
+    listing = select(Favorites_Planets.planet_fav_id).where(Favorites_Planets.user_id == text(':user_id'))
+    params = [{'user_id': random.randint(1, users), 'planet_id': random.randint(1, planets)} for _ in range(repeat)]
+    with engine.connect() as conn:
+        return {
+            'duplicate_check_ms': timed(conn, pair, params, repeat),
+            'user_listing_ms': timed(conn, listing, params, repeat),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--planets', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--db-url')
+    args = parser.parse_args()
+
+    url = args.db_url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'favorites.db')
+    engine = create_engine(url)
+    print('seeding %d favorites for %d users...' % (args.rows, args.users))
+    seed(engine, args.rows, args.users, args.planets)
+
+    with_index = measure(engine, args.users, args.planets, args.repeat)
+    with engine.begin() as conn:
+        for name in INDEX_NAMES:
+            conn.execute(text('DROP INDEX %s' % name))
+    # the sequential scan is slow enough that a few samples are plenty
+    without_index = measure(engine, args.users, args.planets, max(1, args.repeat // 20))
+
+    print('%-22s %12s %12s' % ('query', 'no index', 'index'))
+    for name in with_index:
+        print('%-22s %10.3fms %10.3fms' % (name, without_index[name], with_index[name]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Cost of encoding list responses with the default Flask provider and with
+FastJSONProvider, per 10k rows.
+
+    python benchmarks/json_encoding.py --rows 10000 --repeat 20
+
+That both providers write the same bytes, with and without orjson, is checked
+by tests/test_json_provider.py.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+sys.path.insert(0, HERE)
+
+from seed import person, planet  # noqa: E402
+
+# nothing is read from it: the payloads are built in memory
+DB_URL = 'sqlite:////tmp/bench_json.db'
+
+
+def timed(encode, payload, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        encode(payload)
+        samples.append(time.perf_counter() - start)
+    return min(samples) * 1000, statistics.median(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    from flask.json.provider import DefaultJSONProvider
+    from app import create_app
+    from models import People, Planets, serializer_for
+    import json_provider
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': DB_URL, 'ADMIN_UI': False})
+    stdlib = DefaultJSONProvider(app)
+    fast = json_provider.FastJSONProvider(app)
+
+    with app.app_context():
+        for name, model, factory in (('people', People, person), ('planets', Planets, planet)):
+            fields = serializer_for(model).fields
+            rows = [{field: row[field] for field in fields} for row in map(factory, range(1, args.rows + 1))]
+            payload = {'results': rows, 'next': None}
+            before = timed(stdlib.response, payload, args.repeat)
+            after = timed(fast.response, payload, args.repeat)
+            print('%-8s %d rows  default provider %7.2f ms (median %7.2f)  fast provider %7.2f ms (median %7.2f)  %.1fx' % (
+                name, args.rows, before[0], before[1], after[0], after[1], before[1] / after[1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+"""
+Throughput and latency of every route of src/app.py.
+
+    python benchmarks/run.py --scale small --requests 300 --concurrency 8
+
+Seeds the database (see seed.py), then drives each route through the Flask
+test client one request at a time (p50/p90/p99 latency and SQL statements per
+request) and, for the read routes, through an in-process WSGI load generator
+running --concurrency threads (throughput). Results are written as JSON under
+benchmarks/results/ so two commits can be compared with compare.py.
+"""
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+sys.path.insert(0, HERE)
+
+from seed import DEFAULT_DB_URL, seed, volume_arguments, volumes_from  # noqa: E402
+
+RESULTS_DIR = os.path.join(HERE, 'results')
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def summarize(latencies, statements=None):
+    summary = {
+        'requests': len(latencies),
+        'mean_ms': sum(latencies) / len(latencies) * 1000,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p90_ms': percentile(latencies, 0.90) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+    if statements:
+        summary['statements_mean'] = sum(statements) / len(statements)
+        summary['statements_max'] = max(statements)
+    return summary
+
+
+class Scenarios:
+    """One request factory per route; each call returns (method, path, json body)."""
+
+    def __init__(self, volumes):
+        self.volumes = volumes
+        self.counter = itertools.count()
+        self.deletable = {'people': [], 'planets': []}
+
+    def person_body(self, name):
+        return {'name': name, 'eye_color': 'blue', 'skin_color': 'fair', 'height': '172', 'mass': '77',
+                'hair_color': 'blond', 'birth_year': '19BBY', 'gender': 'male'}
+
+    def planet_body(self, name):
+        return {'planet_name': name, 'rotation_period': '23', 'orbital_period': '304', 'diameter': '10465',
+                'climate': 'arid', 'gravity': '1 standard', 'terrain': 'desert', 'surface_water': '1',
+                'population': '200000'}
+
+    def random_id(self, kind):
+        return random.randint(1, self.volumes[kind])
+
+    def favorite_operation(self):
+        kind = random.choice(['planet', 'people'])
+        return {'op': random.choice(['add', 'remove']), 'type': kind,
+                'id': self.random_id('planets' if kind == 'planet' else 'people')}
+
+    def build(self):
+        v = self
+        unique = lambda prefix: '%s bench %d' % (prefix, next(v.counter))
+        return {
+            'sitemap': lambda: ('GET', '/', None),
+            'route_index': lambda: ('GET', '/routes', None),
+            'get_metrics': lambda: ('GET', '/metrics', None),
+            'get_all_people': lambda: ('GET', '/people', None),
+            'get_people_by_id': lambda: ('GET', '/people/%d' % v.random_id('people'), None),
+            'batch_get_people': lambda: ('POST', '/people/batch-get', {'ids': [v.random_id('people') for _ in range(100)]}),
+            'create_new_char': lambda: ('POST', '/people/create', v.person_body(unique('Character'))),
+            'bulk_create_people': lambda: ('POST', '/people/bulk', [v.person_body(unique('Character')) for _ in range(100)]),
+            'edit_char_by_id': lambda: ('PUT', '/people/edit/%d' % v.random_id('people'), v.person_body(unique('Character'))),
+            'delete_char_by_id': lambda: ('DELETE', '/people/delete/%d' % v.deletable['people'].pop(), None),
+            'get_all_planets': lambda: ('GET', '/planets', None),
+            'get_planet_by_id': lambda: ('GET', '/planets/%d' % v.random_id('planets'), None),
+            'batch_get_planets': lambda: ('POST', '/planets/batch-get', {'ids': [v.random_id('planets') for _ in range(100)]}),
+            'create_new_planet': lambda: ('POST', '/planets/create', v.planet_body(unique('Planet'))),
+            'bulk_create_planets': lambda: ('POST', '/planets/bulk', [v.planet_body(unique('Planet')) for _ in range(100)]),
+            'edit_planet_by_id': lambda: ('PUT', '/planets/edit/%d' % v.random_id('planets'), v.planet_body(unique('Planet'))),
+            'delete_planet_by_id': lambda: ('DELETE', '/planets/delete/%d' % v.deletable['planets'].pop(), None),
+            'get_popular_people': lambda: ('GET', '/people/popular?limit=10', None),
+            'get_popular_planets': lambda: ('GET', '/planets/popular?limit=10', None),
+            'search_catalogue': lambda: ('GET', '/search?q=%s&limit=10' % random.choice(['char', 'planet 1', 'charcter 12', 'plnet']), None),
+            'get_all_users': lambda: ('GET', '/users', None),
+            'get_all_favorites': lambda: ('GET', '/user/%d/favorites' % v.random_id('users'), None),
+            'add_fav_planet_by_id': lambda: ('POST', '/user/%d/favorites/planet/%d' % (v.random_id('users'), v.random_id('planets')), None),
+            'delete_fav_planet_by_id': lambda: ('DELETE', '/delete/favorites/user/%d/planet/%d' % (v.random_id('users'), v.random_id('planets')), None),
+            'patch_favorites': lambda: ('PATCH', '/user/%d/favorites' % v.random_id('users'), [v.favorite_operation() for _ in range(50)]),
+            'add_fav_people_by_id': lambda: ('POST', '/user/%d/favorites/people/%d' % (v.random_id('users'), v.random_id('people')), None),
+            'delete_fav_people_by_id': lambda: ('DELETE', '/delete/favorites/user/%d/people/%d' % (v.random_id('users'), v.random_id('people')), None),
+        }
+
+
+def prepare_deletes(client, scenarios, count):
+    # the delete routes need rows nobody has in favorites
+    for kind, body in (('people', scenarios.person_body), ('planets', scenarios.planet_body)):
+        for start in range(0, count, 500):
+            items = [body('%s to delete %d' % (kind, i)) for i in range(start, min(start + 500, count))]
+            response = client.post('/%s/bulk' % kind, json=items)
+            scenarios.deletable[kind].extend(result['id'] for result in response.json['results'])
+
+
+def sequential(client, factory, requests, counter):
+    latencies, statements, errors = [], [], 0
+    for _ in range(requests):
+        method, path, body = factory()
+        counter['statements'] = 0
+        start = time.perf_counter()
+        response = client.open(path, method=method, json=body)
+        response.get_data()
+        latencies.append(time.perf_counter() - start)
+        statements.append(counter['statements'])
+        if response.status_code >= 500:
+            errors += 1
+    return dict(summarize(latencies, statements), server_errors=errors)
+
+
+def concurrent(app, factory, requests, concurrency):
+    """Drive the WSGI callable from `concurrency` threads, no HTTP server involved."""
+    from werkzeug.test import EnvironBuilder
+
+    lock = threading.Lock()
+    latencies = []
+    remaining = [requests]
+
+    def worker():
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+                method, path, body = factory()
+            environ = EnvironBuilder(path=path, method=method, json=body).get_environ()
+            start = time.perf_counter()
+            chunks = app.wsgi_app(environ, lambda status, headers, exc_info=None: None)
+            for _ in chunks:
+                pass
+            if hasattr(chunks, 'close'):
+                chunks.close()
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    return dict(summarize(latencies), concurrency=concurrency, throughput_rps=len(latencies) / wall)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--db-url', default=os.getenv('BENCH_DATABASE_URL', DEFAULT_DB_URL))
+    volume_arguments(parser)
+    parser.add_argument('--no-seed', action='store_true', help='reuse the data already in --db-url')
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--routes', help='comma separated endpoint names to run (default: all)')
+    parser.add_argument('--output', help='result file (default: benchmarks/results/<commit>-<time>.json)')
+    args = parser.parse_args()
+
+    volumes = volumes_from(args)
+    if not args.no_seed:
+        print('seeding %s with %s' % (args.db_url, volumes))
+        seed(args.db_url, volumes)
+
+    from sqlalchemy import event
+    from app import create_app
+    from models import db
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': args.db_url, 'ADMIN_UI': False})
+    random.seed(2)
+    scenarios = Scenarios(volumes)
+    factories = scenarios.build()
+    counter = {'statements': 0}
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute',
+                     lambda *args: counter.__setitem__('statements', counter['statements'] + 1))
+
+    # scenarios are named after the view, without the blueprint prefix
+    methods = {rule.endpoint.rpartition('.')[2]: (rule.methods - {'HEAD', 'OPTIONS'}).pop() for rule in app.url_map.iter_rules()
+               if not rule.rule.startswith('/admin') and rule.endpoint != 'static'}
+    missing = set(methods) - set(factories)
+    if missing:
+        print('warning: no benchmark scenario for %s' % ', '.join(sorted(missing)))
+
+    selected = args.routes.split(',') if args.routes else sorted(factories)
+    client = app.test_client()
+    prepare_deletes(client, scenarios, args.requests * ('delete_char_by_id' in selected or 'delete_planet_by_id' in selected))
+
+    results = {}
+    for endpoint in selected:
+        factory = factories[endpoint]
+        method = methods[endpoint]
+        result = {'method': method, 'sequential': sequential(client, factory, args.requests, counter)}
+        if method == 'GET':
+            result['concurrent'] = concurrent(app, factory, args.requests, args.concurrency)
+        results[endpoint] = result
+        seq = result['sequential']
+        print('%-26s p50 %8.2fms  p99 %8.2fms  sql %5.1f%s' % (
+            endpoint, seq['p50_ms'], seq['p99_ms'], seq['statements_mean'],
+            '  %8.0f req/s' % result['concurrent']['throughput_rps'] if 'concurrent' in result else ''))
+
+    report = {
+        'commit': git_commit(),
+        'date': datetime.datetime.utcnow().isoformat() + 'Z',
+        'python': platform.python_version(),
+        'db_url': args.db_url.split('@')[-1],
+        'volumes': volumes,
+        'requests': args.requests,
+        'results': results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, '%s-%s.json' % (report['commit'], time.strftime('%Y%m%d%H%M%S')))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as fp:
+        json.dump(report, fp, indent=2, sort_keys=True)
+    print('results written to %s' % output)
+
+
+if __name__ == '__main__':
+    main()
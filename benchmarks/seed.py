@@ -0,0 +1,131 @@
+"""
+Seed a database with a synthetic catalogue for the benchmarks.
+
+    python benchmarks/seed.py --scale large --db-url postgresql://localhost/bench
+
+Drops and recreates every table of src/models.py, then bulk inserts people,
+planets, users and favorites in batches.
+"""
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from sqlalchemy import create_engine, insert  # noqa: E402
+from models import db, numeric_values, User, People, Planets, Favorites_Planets, Favorites_People  # noqa: E402
+from popularity import reconcile  # noqa: E402
+
+DEFAULT_DB_URL = 'sqlite:////tmp/bench.db'
+
+SCALES = {
+    'small': {'people': 1000, 'planets': 200, 'users': 500, 'favorites': 10000},
+    'medium': {'people': 10000, 'planets': 2000, 'users': 5000, 'favorites': 100000},
+    'large': {'people': 100000, 'planets': 10000, 'users': 50000, 'favorites': 1000000},
+}
+
+BATCH_SIZE = 20000
+COLORS = ['blue', 'brown', 'yellow', 'red', 'black', 'green', 'unknown']
+GENDERS = ['male', 'female', 'n/a', 'hermaphrodite', 'none']
+CLIMATES = ['arid', 'temperate', 'tropical', 'frozen', 'murky', 'windy']
+TERRAINS = ['desert', 'grasslands', 'mountains', 'jungle', 'ocean', 'swamp']
+
+
+def swapi_number(low, high):
+    # SWAPI values are strings and sometimes not numbers at all
+    roll = random.random()
+    if roll < 0.05:
+        return 'unknown'
+    value = random.randint(low, high)
+    return '{:,}'.format(value) if roll < 0.15 else str(value)
+
+
+def person(i):
+    row = {
+        'id': i, 'name': 'Character %d' % i, 'height': swapi_number(60, 260), 'mass': swapi_number(15, 1400),
+        'eye_color': random.choice(COLORS), 'skin_color': random.choice(COLORS), 'hair_color': random.choice(COLORS),
+        'birth_year': '%dBBY' % random.randint(1, 900), 'gender': random.choice(GENDERS),
+    }
+    return dict(row, **numeric_values(People, row))
+
+
+def planet(i):
+    row = {
+        'id': i, 'planet_name': 'Planet %d' % i, 'rotation_period': swapi_number(6, 60),
+        'orbital_period': swapi_number(150, 5000), 'diameter': swapi_number(0, 120000),
+        'climate': random.choice(CLIMATES), 'gravity': '1 standard', 'terrain': random.choice(TERRAINS),
+        'surface_water': swapi_number(0, 100), 'population': swapi_number(0, 10 ** 12),
+    }
+    return dict(row, **numeric_values(Planets, row))
+
+
+def user(i):
+    return {'id': i, 'user_name': 'user%d' % i, 'email': 'user%d@example.com' % i, 'password': 'x'}
+
+
+def batches(rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def favorites(volumes, item_column, items):
+    # half of the favorites are planets and half characters, unique per user
+    per_user = max(volumes['favorites'] // 2 // volumes['users'], 1)
+    for user_id in range(1, volumes['users'] + 1):
+        for item_id in random.sample(range(1, items + 1), min(per_user, items)):
+            yield {'user_id': user_id, item_column: item_id}
+
+
+def seed(db_url, volumes, seed_value=1):
+    random.seed(seed_value)
+    engine = create_engine(db_url)
+    db.metadata.drop_all(engine)
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        for model, rows in (
+            (People, (person(i) for i in range(1, volumes['people'] + 1))),
+            (Planets, (planet(i) for i in range(1, volumes['planets'] + 1))),
+            (User, (user(i) for i in range(1, volumes['users'] + 1))),
+            (Favorites_Planets, favorites(volumes, 'planet_fav_id', volumes['planets'])),
+            (Favorites_People, favorites(volumes, 'char_fav_id', volumes['people'])),
+        ):
+            for batch in batches(rows):
+                conn.execute(insert(model), batch)
+        # Core inserts skip the counter maintenance; compute the counters once at the end
+        reconcile(conn)
+    engine.dispose()
+
+
+def volume_arguments(parser):
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    for name in SCALES['small']:
+        parser.add_argument('--' + name, type=int, help='override the %s count of the scale' % name)
+
+
+def volumes_from(args):
+    volumes = dict(SCALES[args.scale])
+    for name in volumes:
+        if getattr(args, name) is not None:
+            volumes[name] = getattr(args, name)
+    return volumes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--db-url', default=os.getenv('BENCH_DATABASE_URL', DEFAULT_DB_URL))
+    volume_arguments(parser)
+    args = parser.parse_args()
+    volumes = volumes_from(args)
+    print('seeding %s with %s' % (args.db_url, volumes))
+    seed(args.db_url, volumes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Cold boot of a worker: what importing the app costs, measured with
+`python -X importtime`, checked against a budget.
+
+    python benchmarks/startup.py --budget-ms 800
+    python benchmarks/startup.py --budget-ms 800 --top 20
+
+Each run starts a fresh interpreter that imports --module (default `wsgi`,
+the module gunicorn loads), which builds the app. The median import time of
+--repeat runs is compared with the budget, and the script exits with status 1
+when it goes over, so it can guard CI. The heaviest packages of the last run
+are listed to show where the time goes.
+
+The interpreter gets the environment the deployed worker runs with: the
+variables the `web:` command of the Procfile sets on top of the current ones,
+and no migrations (those only load under the `flask` command). The admin UI is
+on but, like in the worker, only built by the first request to /admin.
+A variable set in the current environment wins, to measure another setup.
+"""
+import argparse
+import os
+import re
+import shlex
+import statistics
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(HERE, '..', 'src')
+PROCFILE = os.path.join(HERE, '..', 'Procfile')
+
+# import time: self [us] | cumulative | imported package
+LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def measure(module, env):
+    """(total import ms, {package: cumulative ms}) of one fresh interpreter."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+        cwd=SRC, env=env, capture_output=True, text=True,
+    )
+    if result.returncode:
+        sys.exit(result.stderr)
+    total, packages = 0, {}
+    for line in result.stderr.splitlines():
+        found = LINE.match(line)
+        if not found:
+            continue
+        cumulative, depth, name = int(found.group(2)), len(found.group(3)), found.group(4)
+        # top level entries (one space) are what the interpreter and `module` imported themselves
+        if depth == 1:
+            total += cumulative
+        elif name != module:
+            # a package is charged with its outermost import, submodules included
+            root = name.split('.')[0]
+            packages[root] = max(packages.get(root, 0), cumulative / 1000)
+    return total / 1000, packages
+
+
+def deployed_env(procfile=PROCFILE):
+    """The `NAME=value` assignments in front of the `web:` command of the Procfile."""
+    env = {}
+    with open(procfile) as lines:
+        for line in lines:
+            kind, _, command = line.partition(':')
+            if kind.strip() != 'web':
+                continue
+            for word in shlex.split(command):
+                name, equals, value = word.partition('=')
+                if not equals or not name.isidentifier():
+                    break
+                env[name] = value
+    return env
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--module', default='wsgi')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--budget-ms', type=float, default=float(os.getenv('STARTUP_BUDGET_MS', 800)))
+    args = parser.parse_args()
+
+    # a worker as deployed, not a `flask` command: migrations stay off
+    env = dict(deployed_env(), **os.environ)
+    env.pop('FLASK_RUN_FROM_CLI', None)
+
+    # the first run writes the .pyc files and is left out
+    measure(args.module, env)
+    totals = []
+    for _ in range(args.repeat):
+        total, packages = measure(args.module, env)
+        totals.append(total)
+
+    for name, cumulative in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print('%-40s %8.1f ms' % (name, cumulative))
+    median = statistics.median(totals)
+    print('import %s (ADMIN_UI=%s): median %.1f ms, min %.1f ms, budget %.0f ms'
+          % (args.module, env.get('ADMIN_UI', '1'), median, min(totals), args.budget_ms))
+    if median > args.budget_ms:
+        print('over budget by %.1f ms' % (median - args.budget_ms))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+"""table_version validators for people and planets
+
+Revision ID: 3f9c1b7d2e4a
+Revises: 62d03935284c
+Create Date: 2026-10-18 10:12:31.402117
+
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9c1b7d2e4a'
+down_revision = '62d03935284c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    table_version = op.create_table('table_version',
+    sa.Column('name', sa.String(length=80), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.bulk_insert(table_version, [
+        {'name': 'people', 'version': 0, 'updated_at': datetime.utcnow()},
+        {'name': 'planets', 'version': 0, 'updated_at': datetime.utcnow()},
+    ])
+
+
+def downgrade():
+    op.drop_table('table_version')
@@ -0,0 +1,46 @@
+"""unique (user, item) indexes on the favorites tables
+
+Revision ID: 8b2e6d4c1a90
+Revises: 3f9c1b7d2e4a
+Create Date: 2026-10-18 11:02:47.915530
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2e6d4c1a90'
+down_revision = '3f9c1b7d2e4a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # concurrent POSTs may already have stored duplicates: keep the oldest row of
+    # each pair or the unique index can't be built
+    op.execute(
+        'DELETE FROM favorites__planets WHERE id NOT IN '
+        '(SELECT id FROM (SELECT MIN(id) AS id FROM favorites__planets GROUP BY user_id, planet_fav_id) AS keep)'
+    )
+    op.execute(
+        'DELETE FROM favorites__people WHERE id NOT IN '
+        '(SELECT id FROM (SELECT MIN(id) AS id FROM favorites__people GROUP BY user_id, char_fav_id) AS keep)'
+    )
+    with op.batch_alter_table('favorites__planets', schema=None) as batch_op:
+        batch_op.create_index('ix_favorites__planets_user_id_planet_fav_id', ['user_id', 'planet_fav_id'], unique=True)
+        batch_op.create_index(batch_op.f('ix_favorites__planets_planet_fav_id'), ['planet_fav_id'], unique=False)
+
+    with op.batch_alter_table('favorites__people', schema=None) as batch_op:
+        batch_op.create_index('ix_favorites__people_user_id_char_fav_id', ['user_id', 'char_fav_id'], unique=True)
+        batch_op.create_index(batch_op.f('ix_favorites__people_char_fav_id'), ['char_fav_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('favorites__people', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_favorites__people_char_fav_id'))
+        batch_op.drop_index('ix_favorites__people_user_id_char_fav_id')
+
+    with op.batch_alter_table('favorites__planets', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_favorites__planets_planet_fav_id'))
+        batch_op.drop_index('ix_favorites__planets_user_id_planet_fav_id')
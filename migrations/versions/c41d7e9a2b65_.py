@@ -0,0 +1,48 @@
+"""facet indexes on people/planets and trigram name indexes on postgres
+
+Revision ID: c41d7e9a2b65
+Revises: 8b2e6d4c1a90
+Create Date: 2026-10-18 15:20:11.402817
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41d7e9a2b65'
+down_revision = '8b2e6d4c1a90'
+branch_labels = None
+depends_on = None
+
+FACET_INDEXES = {
+    'people': ('gender', 'eye_color', 'hair_color', 'skin_color'),
+    'planets': ('climate', 'terrain'),
+}
+TRIGRAM_INDEXES = (
+    ('ix_people_name_trgm', 'people', 'name'),
+    ('ix_planets_planet_name_trgm', 'planets', 'planet_name'),
+)
+
+
+def upgrade():
+    for table, columns in FACET_INDEXES.items():
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for column in columns:
+                batch_op.create_index('ix_%s_%s_id' % (table, column), [column, 'id'], unique=False)
+
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for name, table, column in TRIGRAM_INDEXES:
+            op.execute('CREATE INDEX %s ON %s USING gin (%s gin_trgm_ops)' % (name, table, column))
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for name, table, column in TRIGRAM_INDEXES:
+            op.execute('DROP INDEX %s' % name)
+
+    for table, columns in FACET_INDEXES.items():
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for column in columns:
+                batch_op.drop_index('ix_%s_%s_id' % (table, column))
@@ -0,0 +1,76 @@
+"""numeric copies of the SWAPI number columns, backfilled and indexed
+
+Revision ID: d7a3f0b58e12
+Revises: c41d7e9a2b65
+Create Date: 2026-10-18 17:44:03.118264
+
+"""
+import math
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7a3f0b58e12'
+down_revision = 'c41d7e9a2b65'
+branch_labels = None
+depends_on = None
+
+NUMERIC_FIELDS = {
+    'people': ('height', 'mass'),
+    'planets': ('rotation_period', 'orbital_period', 'diameter', 'surface_water', 'population'),
+}
+BACKFILL_BATCH = 5000
+
+
+def parse_number(raw):
+    # frozen copy of models.parse_number, so later changes to the model don't alter this migration
+    try:
+        value = float(str(raw).replace(',', '').strip())
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) else None
+
+
+def backfill(table, fields):
+    bind = op.get_bind()
+    source = sa.table(table, sa.column('id'), *[sa.column(field) for field in fields])
+    target = sa.table(table, sa.column('id'), *[sa.column(field + '_num') for field in fields])
+    update = (
+        target.update()
+        .where(target.c.id == sa.bindparam('row_id'))
+        .values({field + '_num': sa.bindparam('v_' + field) for field in fields})
+    )
+    last = 0
+    while True:
+        rows = bind.execute(
+            sa.select(source).where(source.c.id > last).order_by(source.c.id).limit(BACKFILL_BATCH)
+        ).fetchall()
+        if not rows:
+            return
+        bind.execute(update, [
+            dict({'row_id': row.id}, **{'v_' + field: parse_number(getattr(row, field)) for field in fields})
+            for row in rows
+        ])
+        last = rows[-1].id
+
+
+def upgrade():
+    for table, fields in NUMERIC_FIELDS.items():
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for field in fields:
+                batch_op.add_column(sa.Column(field + '_num', sa.Float(), nullable=True))
+
+        backfill(table, fields)
+
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for field in fields:
+                batch_op.create_index('ix_%s_%s_num_id' % (table, field), [field + '_num', 'id'], unique=False)
+
+
+def downgrade():
+    for table, fields in NUMERIC_FIELDS.items():
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for field in fields:
+                batch_op.drop_index('ix_%s_%s_num_id' % (table, field))
+                batch_op.drop_column(field + '_num')
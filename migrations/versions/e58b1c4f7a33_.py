@@ -0,0 +1,44 @@
+"""favorite counters on people and planets
+
+Revision ID: e58b1c4f7a33
+Revises: d7a3f0b58e12
+Create Date: 2026-10-18 19:05:37.640151
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e58b1c4f7a33'
+down_revision = 'd7a3f0b58e12'
+branch_labels = None
+depends_on = None
+
+# table -> (favorites table, column pointing to the table)
+COUNTED = {
+    'people': ('favorites__people', 'char_fav_id'),
+    'planets': ('favorites__planets', 'planet_fav_id'),
+}
+
+
+def upgrade():
+    for table, (favorites, column) in COUNTED.items():
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('favorite_count', sa.Integer(), nullable=False, server_default='0'))
+
+        op.execute(
+            'UPDATE {table} SET favorite_count = '
+            '(SELECT COUNT(*) FROM {favorites} WHERE {favorites}.{column} = {table}.id)'.format(
+                table=table, favorites=favorites, column=column)
+        )
+
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.create_index('ix_%s_favorite_count_id' % table, ['favorite_count', 'id'], unique=False)
+
+
+def downgrade():
+    for table in COUNTED:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index('ix_%s_favorite_count_id' % table)
+            batch_op.drop_column('favorite_count')
@@ -0,0 +1,32 @@
+"""table_version rows for user and favorites
+
+Revision ID: f2b6c8d91e47
+Revises: e58b1c4f7a33
+Create Date: 2026-10-19 09:41:08.215530
+
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2b6c8d91e47'
+down_revision = 'e58b1c4f7a33'
+branch_labels = None
+depends_on = None
+
+NAMES = ('user', 'favorites')
+
+
+def upgrade():
+    table_version = sa.table('table_version',
+        sa.column('name', sa.String),
+        sa.column('version', sa.Integer),
+        sa.column('updated_at', sa.DateTime),
+    )
+    op.bulk_insert(table_version, [{'name': name, 'version': 0, 'updated_at': datetime.utcnow()} for name in NAMES])
+
+
+def downgrade():
+    op.execute(sa.text('DELETE FROM table_version WHERE name IN (:user, :favorites)').bindparams(user='user', favorites='favorites'))
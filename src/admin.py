@@ -1,4 +1,5 @@
 import os
+from flask import Flask
 from flask_admin import Admin
 from models import db, User, Favorites_Planets, Favorites_People, People, Planets
 from flask_admin.contrib.sqla import ModelView
@@ -19,4 +20,17 @@ def setup_admin(app):
     # admin.add_view(ModelView(YourModelName, db.session))
 
     # You can duplicate that line to add mew models
-    # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
+    # admin.add_view(ModelView(YourModelName, db.session))
+
+
+def create_admin_app(config):
+    """The admin UI as a Flask app of its own, on the database settings of the API app.
+
+    The API builds it on the first request to /admin, so its workers boot
+    without importing flask-admin and still serve the admin.
+    """
+    app = Flask(__name__)
+    app.config.update({key: value for key, value in config.items() if key.startswith('SQLALCHEMY_')})
+    db.init_app(app)
+    setup_admin(app)
+    return app
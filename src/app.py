@@ -2,86 +2,174 @@
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
 import os
-from flask import Flask, request, jsonify, url_for
-from flask_migrate import Migrate
-from flask_swagger import swagger
+from flask import Blueprint, Flask, Response, request, jsonify
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
-from admin import setup_admin
-from models import db, User, People, Planets, Favorites_Planets, Favorites_People
-
-
-
-app = Flask(__name__)
-app.url_map.strict_slashes = False
-
-db_url = os.getenv("DATABASE_URL")
-if db_url is not None:
-    app.config['SQLALCHEMY_DATABASE_URI'] = db_url.replace("postgres://", "postgresql://")
-else:
-    app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-MIGRATE = Migrate(app, db)
-db.init_app(app)
-CORS(app)
-setup_admin(app)
+from sqlalchemy import delete, exists, insert, literal, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+from utils import APIException, LazyMount, generate_sitemap, memoized_response, route_table
+from pagination import page_size, paginate, sort_order, wants_stream, ndjson_response
+from cache import cached_response, conditional
+from bulk import bulk_upsert
+from search import list_filters, search, sort_param
+from popularity import count_change, top
+from favorites import apply_operations, names_statement
+from multiget import body_ids, multi_get_body, multi_get_statements, parse_ids
+import popularity
+import catalogue
+from changes import mark_changed
+from pool import engine_options
+import metrics
+import monitoring
+import compression
+from json_provider import FastJSONProvider, dumps_bytes
+from models import db, User, People, Planets, Favorites_Planets, Favorites_People, serializer_for
+
+api = Blueprint('api', __name__)
+
+
+def create_app(config=None):
+    """Build the app; `config` overrides the settings read from the environment.
+
+    Flask-Migrate (MIGRATIONS) is only imported when it is on, and the admin UI
+    (ADMIN_UI) is built by the first request to /admin, so a worker doesn't pay
+    for either at boot.
+    """
+    app = Flask(__name__)
+    app.url_map.strict_slashes = False
+    #las respuestas se codifican con orjson si esta instalado (mismos bytes que jsonify)
+    app.json = FastJSONProvider(app)
+
+    db_url = os.getenv("DATABASE_URL")
+    if db_url is not None:
+        app.config['SQLALCHEMY_DATABASE_URI'] = db_url.replace("postgres://", "postgresql://")
+    else:
+        app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    #el admin se apaga con ADMIN_UI=0; encendido se carga con la primera peticion a /admin
+    app.config['ADMIN_UI'] = os.getenv('ADMIN_UI', '1') == '1'
+    #flask-migrate (y alembic) solo hacen falta para los comandos `flask db ...`
+    app.config['MIGRATIONS'] = os.getenv('FLASK_RUN_FROM_CLI') == 'true'
+    app.config.update(config or {})
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config['SQLALCHEMY_DATABASE_URI']))
+
+    db.init_app(app)
+    if app.config['MIGRATIONS']:
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    CORS(app)
+    if app.config['ADMIN_UI']:
+        app.wsgi_app = LazyMount(app.wsgi_app, '/admin', lambda: _admin_app(app))
+    monitoring.init_app(app)
+    #se registra despues de monitoring para que las metricas midan el cuerpo ya comprimido
+    compression.init_app(app)
+    popularity.init_app(app)
+    app.register_blueprint(api)
+    return app
+
+def _admin_app(app):
+    #flask-admin (y wtforms) se importan aqui, no al arrancar el worker
+    from admin import create_admin_app
+    return create_admin_app(app.config)
 
 # Handle/serialize errors like a JSON object
-@app.errorhandler(APIException)
+@api.app_errorhandler(APIException)
 def handle_invalid_usage(error):
     return jsonify(error.to_dict()), error.status_code
 
+# metrics in prometheus text format (requests per route, sql per request, pool health)
+@api.route('/metrics')
+def get_metrics():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 # generate sitemap with all your endpoints
-@app.route('/')
+@api.route('/')
 def sitemap():
-    return generate_sitemap(app)
+    #el sitemap solo cambia si cambian las rutas: se arma una vez por app y se sirve con ETag
+    return memoized_response('sitemap', lambda app: generate_sitemap(app).encode(), 'text/html')
+
+
+@api.route('/routes')
+def route_index():
+    #las mismas rutas en JSON, con sus metodos y parametros, para generar clientes
+    return memoized_response('routes', lambda app: dumps_bytes({'routes': route_table(app)}) + b'\n', 'application/json')
+
 
+def multi_get(model, ids, fields):
+    #un WHERE id IN (...) por cada bloque de ids en vez de una peticion por id
+    serializer = serializer_for(model)
+    snapshot = catalogue.snapshot(model)
+    if snapshot is not None:
+        return multi_get_body(snapshot.get_many(ids), ids, lambda row: serializer.dump(row, fields))
+    rows = [row for stmt in multi_get_statements(model, serializer, fields, ids) for row in db.session.execute(stmt)]
+    return multi_get_body(rows, ids, lambda row: serializer.dump(row, fields))
 
-@app.route('/people')
+
+@api.route('/people')
+@conditional('people')
+@cached_response('people')
 def get_all_people():
-    #hago un query all para retornar todas las columnas de la tabla people
-    all_people = People.query.all()
-
-    #hago un for in para luego retornarlo en formato json 
-    people_list = [{
-        "id":  people.id, 
-        'name': people.name, 
-        'eye_color' : people.eye_color, 
-        'skin_color' : people.skin_color,
-        'height' : people.height,
-        'hair_color' : people.hair_color,
-        'birth_year' : people.birth_year, 
-        'gender' : people.gender,   
-        'mass' : people.mass    
-        } 
-        for people in all_people]       
-        
-    return jsonify(people_list), 200
+    #devuelvo la tabla people por paginas (?limit=&cursor=), nunca la tabla completa;
+    #con ?fields=name,gender solo se seleccionan esas columnas, con ?gender=male&eye_color=blue,red
+    #o ?min_height=150&max_mass=80 se filtra en la base de datos y ?sort=-height ordena alli mismo
+    people = serializer_for(People)
+    fields = people.parse_fields(request.args.get('fields'))
+    serialize = lambda row: people.dump(row, fields)
+    #con ?ids=1,5,9 devuelvo solo esos personajes (y los ids que no existen) en una sola consulta
+    if 'ids' in request.args:
+        return jsonify(multi_get(People, parse_ids(request.args['ids']), fields)), 200
+    #con CATALOGUE_PRELOAD la pagina (filtros, orden y cursor incluidos) sale de la copia en memoria
+    snapshot = catalogue.snapshot(People)
+    if snapshot is not None and not wants_stream():
+        return jsonify(catalogue.list_page(snapshot, People, request.args, serialize)), 200
+    stmt = people.select(fields).where(*list_filters(People, request.args))
+    sort = sort_param(People, request.args)
+
+    #para exportar la tabla completa (?stream=1) la envio fila por fila en NDJSON
+    if wants_stream():
+        return ndjson_response(stmt.order_by(*sort_order(*sort)) if sort else stmt, People.id, serialize)
+
+    return jsonify(paginate(stmt, People.id, serialize, sort)), 200
+    
     
+
+@api.route('/people/batch-get', methods=['POST'])
+def batch_get_people():
+    #lo mismo que /people?ids= pero con los ids en el body ({"ids": [1, 5, 9]}) para listas largas
+    people = serializer_for(People)
+    fields = people.parse_fields(request.args.get('fields'))
+    return jsonify(multi_get(People, body_ids(request.get_json(silent=True)), fields)), 200
+
+
+@api.route('/people/popular')
+@cached_response('favorites', 'people')
+def get_popular_people():
+    #los personajes con mas favoritos; se leen del contador ya calculado, sin GROUP BY
+    return jsonify({'results': top(People, page_size())}), 200
+
     
-@app.route('/people/<int:char_id>')
+@api.route('/people/<int:char_id>')
+@conditional('people')
+@cached_response('people')
 def get_people_by_id(char_id):
-    #hago un query.get para traer el id del personaje para luego devolverlo en formato json
-    people = People.query.get(char_id)
-    if people:
-        return jsonify({
-             "id":  people.id, 
-            'name': people.name, 
-            'eye_color' : people.eye_color, 
-            'skin_color' : people.skin_color,
-            'height' : people.height,
-            'hair_color' : people.hair_color,
-            'birth_year' : people.birth_year, 
-            'gender' : people.gender,
-            'mass' : people.mass,       
-            }), 200
+    #traigo solo las columnas pedidas del personaje para luego devolverlo en formato json;
+    #la respuesta queda en cache hasta que cambie algo en la tabla people
+    people = serializer_for(People)
+    fields = people.parse_fields(request.args.get('fields'))
+    #con CATALOGUE_PRELOAD el personaje sale de la copia en memoria, sin consulta
+    snapshot = catalogue.snapshot(People)
+    if snapshot is not None:
+        row = snapshot.get(char_id)
+    else:
+        row = db.session.execute(people.select(fields).where(People.id == char_id)).first()
+    if row:
+        return jsonify(people.dump(row, fields)), 200
     # en caso de que el id de ese personaje no exista se retorna un mensaje de error 
     else :
         return jsonify ( {'msg' : 'this character not exist :('}), 404
     
 # declaro mi decorador con un metodo POST
-@app.route('/people/create', methods=['POST'])
+@api.route('/people/create', methods=['POST'])
 def create_new_char():
 
 #mediante los datos capturados del request declaro el objeto new_people
@@ -107,24 +195,21 @@ def create_new_char():
         db.session.add(new_people)
         db.session.commit()
 
-        return jsonify({
-                'id': new_people.id,
-                'name' : new_people.name,
-                'eye_color': new_people.eye_color,
-                'skin_color' : new_people.skin_color,
-                'mass' : new_people.mass,
-                'hair_color' : new_people.hair_color,
-                'height' : new_people.height,
-                'birth_year' : new_people.birth_year,
-                'gender' : new_people.gender
-                }), 200
+        return jsonify(new_people.serialize()), 200
     
     else :
         return jsonify({'msg': 'this character already exist'}), 400
     
 
 
-@app.route('/people/edit/<int:char_id>', methods=['PUT'])
+@api.route('/people/bulk', methods=['POST'])
+def bulk_create_people():
+    #recibo un array JSON (o un stream NDJSON) de personajes y los inserto por lotes;
+    #con ?on_conflict=update se sobreescriben los que ya existen por nombre
+    return jsonify(bulk_upsert(People, People.name)), 200
+
+
+@api.route('/people/edit/<int:char_id>', methods=['PUT'])
 def edit_char_by_id(char_id):
     #busco el personaje mediante el id recivido en el path
     char_from_db = People.query.get(char_id)
@@ -145,86 +230,97 @@ def edit_char_by_id(char_id):
         #guardo los cambios en la base de datos
         db.session.commit()
 
-        return jsonify({
-            'id' : char_from_db.id,
-            'name' : char_from_db.name,
-            'eye_color' : char_from_db.eye_color,
-            'skin_color' : char_from_db.skin_color,
-            'hair_color' : char_from_db.hair_color,
-            'height' : char_from_db.height,
-            'birth_year' : char_from_db.birth_year,
-            'gender' : char_from_db.gender,
-            'mass' : char_from_db.mass,
-            
-        }), 200
+        return jsonify(char_from_db.serialize()), 200
     
     else:
         return jsonify({
             'msg' : 'this char not exits'
         }), 404
     
-@app.route('/people/delete/<int:char_id>', methods=['DELETE'])
+@api.route('/people/delete/<int:char_id>', methods=['DELETE'])
 def delete_char_by_id(char_id):
-    user_exist_db = People.query.get(char_id)
-
-    #me aseguro de que el usuario que se quiere eliminar existe en la base de datos
-    if user_exist_db:
-        db.session.delete(user_exist_db)
+    #borro en una sola sentencia; no se borra un personaje que alguien tiene en favoritos
+    result = db.session.execute(
+        delete(People)
+        .where(People.id == char_id, ~exists().where(Favorites_People.char_fav_id == char_id))
+        .execution_options(synchronize_session=False)
+    )
+
+    if result.rowcount:
+        mark_changed(db.session, 'people', char_id)
         db.session.commit()
         return jsonify({
             'msg' : 'character deleted!!'
-        })
-    else:
+        }), 200
+
+    #solo si no se borro nada averiguo por que
+    db.session.rollback()
+    if db.session.get(People, char_id):
         return jsonify({
-            'msg' : 'this character not exist :(' 
-        })
+            'msg' : 'this character is in the favorites of some user'
+        }), 409
+    return jsonify({
+        'msg' : 'this character not exist :(' 
+    }), 404
 
 #-----------------------planets end points------------------------------------
 
-@app.route('/planets')
+@api.route('/planets')
+@conditional('planets')
+@cached_response('planets')
 def get_all_planets():
-    
-    all_planets = Planets.query.all()
-    planets_list = [{
-        "id": planet.id, 
-        'planet_name': planet.planet_name, 
-        'rotation_period' : planet.rotation_period, 
-        'orbital_period' : planet.orbital_period,
-        'diameter' : planet.diameter,
-        'climate' : planet.climate,
-        'gravity' : planet.gravity, 
-        'terrain' : planet.terrain,   
-        'surface_water' : planet.surface_water,
-        'population' : planet.population       
-        } 
-        for planet in all_planets]       
-        
-    return jsonify(planets_list), 200
+    planets = serializer_for(Planets)
+    fields = planets.parse_fields(request.args.get('fields'))
+    serialize = lambda row: planets.dump(row, fields)
+    if 'ids' in request.args:
+        return jsonify(multi_get(Planets, parse_ids(request.args['ids']), fields)), 200
+    #con CATALOGUE_PRELOAD la pagina (filtros, orden y cursor incluidos) sale de la copia en memoria
+    snapshot = catalogue.snapshot(Planets)
+    if snapshot is not None and not wants_stream():
+        return jsonify(catalogue.list_page(snapshot, Planets, request.args, serialize)), 200
+    stmt = planets.select(fields).where(*list_filters(Planets, request.args))
+    sort = sort_param(Planets, request.args)
+
+    if wants_stream():
+        return ndjson_response(stmt.order_by(*sort_order(*sort)) if sort else stmt, Planets.id, serialize)
+
+    return jsonify(paginate(stmt, Planets.id, serialize, sort)), 200
+
+
+
+@api.route('/planets/batch-get', methods=['POST'])
+def batch_get_planets():
+    planets = serializer_for(Planets)
+    fields = planets.parse_fields(request.args.get('fields'))
+    return jsonify(multi_get(Planets, body_ids(request.get_json(silent=True)), fields)), 200
+
+
+@api.route('/planets/popular')
+@cached_response('favorites', 'planets')
+def get_popular_planets():
+    return jsonify({'results': top(Planets, page_size())}), 200
 
     
-@app.route('/planets/<int:planet_id>')
+@api.route('/planets/<int:planet_id>')
+@conditional('planets')
+@cached_response('planets')
 def get_planet_by_id(planet_id):
 
-    planet = Planets.query.get(planet_id)
-    if planet:
+    planets = serializer_for(Planets)
+    fields = planets.parse_fields(request.args.get('fields'))
+    snapshot = catalogue.snapshot(Planets)
+    if snapshot is not None:
+        row = snapshot.get(planet_id)
+    else:
+        row = db.session.execute(planets.select(fields).where(Planets.id == planet_id)).first()
+    if row:
 
-        return jsonify({
-             "id":  planet.id, 
-            'planet_name': planet.planet_name, 
-            'rotation_period' : planet.rotation_period, 
-            'orbital_period' : planet.orbital_period,
-            'diameter' : planet.diameter,
-            'climate' : planet.climate,
-            'gravity' : planet.gravity, 
-            'surface_water' : planet.surface_water,
-            'terrain' : planet.terrain,   
-            'population' : planet.population,      
-            }), 200
+        return jsonify(planets.dump(row, fields)), 200
     
     else :
         return jsonify({'msg' : 'That planet not exist :('}), 404
 
-@app.route('/planets/create', methods=['POST'])
+@api.route('/planets/create', methods=['POST'])
 def create_new_planet():
 
     new_planet = Planets(
@@ -245,23 +341,17 @@ def create_new_planet():
 
         db.session.add(new_planet)
         db.session.commit()
-        return jsonify({
-                "id":  new_planet.id, 
-                'planet_name': new_planet.planet_name, 
-                'rotation_period' : new_planet.rotation_period, 
-                'orbital_period' : new_planet.orbital_period,
-                'diameter' : new_planet.diameter,
-                'climate' : new_planet.climate,
-                'gravity' : new_planet.gravity, 
-                'surface_water' : new_planet.surface_water,
-                'terrain' : new_planet.terrain,   
-                'population' : new_planet.population,     
-                }), 200
+        return jsonify(new_planet.serialize()), 200
     else :
         return jsonify({'msg': 'this planet already exist'}), 400
 
 
-@app.route('/planets/edit/<int:planet_id>', methods=['PUT'])
+@api.route('/planets/bulk', methods=['POST'])
+def bulk_create_planets():
+    return jsonify(bulk_upsert(Planets, Planets.planet_name)), 200
+
+
+@api.route('/planets/edit/<int:planet_id>', methods=['PUT'])
 def edit_planet_by_id(planet_id):
 
     planet_from_db = Planets.query.get(planet_id)
@@ -278,54 +368,60 @@ def edit_planet_by_id(planet_id):
         planet_from_db.population = request.json.get('population')
         db.session.commit()
 
-        return jsonify({
-            'id' : planet_from_db.id,
-            'planet_name' : planet_from_db.planet_name,
-            'rotation_period' : planet_from_db.rotation_period,
-            'orbital_period' : planet_from_db.orbital_period,
-            'diameter' : planet_from_db.diameter,
-            'climate' : planet_from_db.climate,
-            'gravity' : planet_from_db.gravity,
-            'surface_water' : planet_from_db.surface_water,
-            'terrain' : planet_from_db.terrain,
-            'population' : planet_from_db.population,    
-            
-        }), 200
+        return jsonify(planet_from_db.serialize()), 200
     
     else:
         return jsonify({ 'msg' : 'that Planet not exits' }), 404
     
-@app.route('/planets/delete/<int:planet_id>', methods=['DELETE'])
+@api.route('/planets/delete/<int:planet_id>', methods=['DELETE'])
 def delete_planet_by_id(planet_id):
-    planet_exist_db = Planets.query.get(planet_id)
-
-    if planet_exist_db:
-        db.session.delete(planet_exist_db)
+    result = db.session.execute(
+        delete(Planets)
+        .where(Planets.id == planet_id, ~exists().where(Favorites_Planets.planet_fav_id == planet_id))
+        .execution_options(synchronize_session=False)
+    )
+
+    if result.rowcount:
+        mark_changed(db.session, 'planets', planet_id)
         db.session.commit()
         return jsonify({
             'msg' : 'planet deleted!!'
-        })
-    else:
+        }), 200
+
+    db.session.rollback()
+    if db.session.get(Planets, planet_id):
         return jsonify({
-            'msg' : 'that planet not exist :(' 
-        })
+            'msg' : 'that planet is in the favorites of some user'
+        }), 409
+    return jsonify({
+        'msg' : 'that planet not exist :(' 
+    }), 404
 
-# -------------------------------------------User End points--------------------------------------------
-@app.route('/users')
-def get_all_users():
-    all_users = User.query.all()
-    list_of_users = [{
-        'id' : user.id,
-        'user_name' : user.user_name,
+#-----------------------busqueda------------------------------------
 
-    } for user in all_users]
+@api.route('/search')
+@cached_response('people', 'planets')
+def search_catalogue():
+    #?q= busca por nombre (prefijo o parecido), ?type=people,planets y las facetas filtran;
+    #cada tipo devuelve sus resultados, el total y el conteo por faceta
+    return jsonify(search(request.args)), 200
 
-    return jsonify(list_of_users), 200
+# -------------------------------------------User End points--------------------------------------------
+@api.route('/users')
+def get_all_users():
+    users = serializer_for(User)
+    return jsonify(paginate(users.select(), User.id, users.dump)), 200
 
 
-@app.route('/user/<int:user_id>/favorites')
+@api.route('/user/<int:user_id>/favorites')
+@cached_response('favorites:{user_id}', 'people', 'planets', 'user')
 def get_all_favorites(user_id):
-    user_query = User.query.filter_by(id = user_id).first()
+    # traigo el usuario y sus dos listas de favoritos con una consulta por tipo;
+    # el nombre del planeta/personaje viene en el mismo SELECT gracias al join del backref
+    user_query = User.query.options(
+        selectinload(User.favorites_planets),
+        selectinload(User.favorites_chars),
+    ).filter_by(id = user_id).first()
 
     #me aseguro de que el usuario exista en la base datos
     if user_query:
@@ -335,16 +431,16 @@ def get_all_favorites(user_id):
             'user_id' : fav.user_id,
             'user_name' : user_query.user_name,
             'planet_fav_id' : fav.planet_fav_id,
-            'planet_name' : Planets.query.filter_by(id = fav.planet_fav_id).first().planet_name,    
+            'planet_name' : fav.planets.planet_name,    
             
         } for fav in user_query.favorites_planets]
 
-    #hago un blucle for accediendo a la tabla favorites planets mediante el foreinkey 
+    #hago un blucle for accediendo a la tabla favorites people mediante el foreinkey 
         list_of_fav_chars = [{
                 'user_id' : fav.user_id,
                 'user_name' : user_query.user_name,
                 'char_fav_id' : fav.char_fav_id,
-                'char_name' : People.query.filter_by(id = fav.char_fav_id).first().name,    
+                'char_name' : fav.people.name,    
                 
             } for fav in user_query.favorites_chars]
 
@@ -362,108 +458,140 @@ def get_all_favorites(user_id):
         #en caso de que el usuario no exista 
         return jsonify({'msg' : 'this user not exist :('}), 404
 
+@api.route('/user/<int:user_id>/favorites', methods=['PATCH'])
+def patch_favorites(user_id):
+    #recibo una lista de operaciones [{"op": "add"|"remove", "type": "planet"|"people", "id": 3}, ...],
+    #compruebo todos los ids con una sola consulta y aplico todo en una sola transaccion
+    try:
+        result = apply_operations(user_id, request.get_json(silent=True))
+    except IntegrityError:
+        #otra peticion agrego los mismos favoritos a la vez; no se aplico nada
+        db.session.rollback()
+        return jsonify({'msg': 'the favorites changed while applying the operations, try again'}), 409
+
+    if result is None:
+        return jsonify({'msg' : 'this user not exist :('}), 404
+    return jsonify(result), 200
+
 #--------------------------planetas favoritos end points-------------------------------------------
-@app.route('/user/<int:user_id>/favorites/planet/<int:planet_id>', methods=['POST'])
+@api.route('/user/<int:user_id>/favorites/planet/<int:planet_id>', methods=['POST'])
 def add_fav_planet_by_id(user_id, planet_id):
-    user_exits_db = User.query.get(user_id)
-    planet_exist_db = Planets.query.get(planet_id)
-    user_and_planet_exist_table = Favorites_Planets.query.filter_by(planet_fav_id= planet_id, user_id = user_id).first()
-
-    #me aseguro de que tanto el usuario  como el planeta existan en la base de datos para poder agregarlos
-    if user_exits_db and planet_exist_db : 
-
-    #me aseguro de que el planeta no exista en la tabla de planetas favoritos        
-            if not user_and_planet_exist_table:
-
-                new_fav_planet = Favorites_Planets(user_id = user_exits_db.id, planet_fav_id = planet_exist_db.id)
-                db.session.add(new_fav_planet)
-                db.session.commit()
-
-                return jsonify({
-                    'planet_id' : planet_exist_db.id,    
-                    'planet_fav_name' : planet_exist_db.planet_name,
-                    'user_name' : user_exits_db.user_name,
-                    'user_id' : user_exits_db.id,                  
-                })
-            
-            else:
-                return jsonify({
-                    'msg' : 'that planet already exist'
-                }), 400
-        
-    else:
+    #INSERT ... SELECT: solo inserta si existen el usuario y el planeta, y el indice
+    #unico (user_id, planet_fav_id) rechaza los repetidos; todo en un viaje a la base
+    try:
+        result = db.session.execute(
+            insert(Favorites_Planets).from_select(
+                ['user_id', 'planet_fav_id'],
+                select(User.id, literal(planet_id)).where(User.id == user_id, exists().where(Planets.id == planet_id)),
+            )
+        )
+        if result.rowcount:
+            #sumo uno al contador de popularidad del planeta en la misma transaccion
+            db.session.execute(count_change(Planets, planet_id, 1))
+            #los nombres para la respuesta, en la misma transaccion y por clave primaria
+            names = db.session.execute(names_statement(user_id, Planets.planet_name, planet_id)).first()
+            mark_changed(db.session, 'favorites', user_id)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({
+            'msg' : 'that planet already exist'
+        }), 409
+
+    if not result.rowcount:
         return jsonify({'msg' : 'the planet or the user not esxist :('}), 404
+
+    return jsonify({
+        'planet_id' : planet_id,
+        'planet_fav_name' : names.planet_name,
+        'user_name' : names.user_name,
+        'user_id' : user_id,
+    }), 200
     
-@app.route('/delete/favorites/user/<int:user_id>/planet/<int:planet_id>', methods=['DELETE'])
+@api.route('/delete/favorites/user/<int:user_id>/planet/<int:planet_id>', methods=['DELETE'])
 def delete_fav_planet_by_id(user_id, planet_id):
    
-   #hago una busqueda donde el planet_id y el user_id esten en la misma fila
-    search_planet_and_user_favorites_table = Favorites_Planets.query.filter_by( planet_fav_id = planet_id, user_id = user_id).first()
-
-    if search_planet_and_user_favorites_table:
-
-        #guardo los cambios en la base de datos
-        db.session.delete(search_planet_and_user_favorites_table)
+   #borro la fila donde el planet_id y el user_id esten en la misma fila, sin buscarla antes
+    result = db.session.execute(
+        delete(Favorites_Planets)
+        .where(Favorites_Planets.planet_fav_id == planet_id, Favorites_Planets.user_id == user_id)
+        .execution_options(synchronize_session=False)
+    )
+
+    if result.rowcount:
+
+        #resto uno al contador y guardo los cambios en la base de datos
+        db.session.execute(count_change(Planets, planet_id, -1))
+        mark_changed(db.session, 'favorites', user_id)
         db.session.commit()
         return jsonify({
             'msg' : 'planet deleted!'
         }), 200
 
     else:
+        db.session.rollback()
         return jsonify({
             'msg' : 'this user or this planet not exist'
         }), 404
 
 #--------------------------------------------personajes favoritos end points----------------------------------------------
-@app.route('/user/<int:user_id>/favorites/people/<int:people_id>', methods=['POST'])
+@api.route('/user/<int:user_id>/favorites/people/<int:people_id>', methods=['POST'])
 def add_fav_people_by_id(user_id, people_id):
-    user_exits_db = User.query.get(user_id)
-    people_exist_db = People.query.get(people_id)
-    user_and_people_exist_table = Favorites_People.query.filter_by(char_fav_id= people_id, user_id = user_id).first()
-
-    #me aseguro de que tanto el usuario  como el personaje existan en la base de datos para poder agregarlos
-    if user_exits_db and people_exist_db : 
-
-    #me aseguro de que el personaje no exista en la tabla de personajes favoritos        
-            if not user_and_people_exist_table:
-
-                new_fav_char = Favorites_People(user_id = user_exits_db.id, char_fav_id = people_exist_db.id)
-                db.session.add(new_fav_char)
-                db.session.commit()
-
-                return jsonify({
-                    'people_id' : people_exist_db.id,    
-                    'people_fav_name' :people_exist_db.name,
-                    'user_name' : user_exits_db.user_name,
-                    'user_id' : user_exits_db.id,                  
-                })
-            
-            else:
-                return jsonify({
-                    'msg' : 'this character already exist'
-                }), 400
-        
-    else:
+    #INSERT ... SELECT: solo inserta si existen el usuario y el personaje, y el indice
+    #unico (user_id, char_fav_id) rechaza los repetidos; todo en un viaje a la base
+    try:
+        result = db.session.execute(
+            insert(Favorites_People).from_select(
+                ['user_id', 'char_fav_id'],
+                select(User.id, literal(people_id)).where(User.id == user_id, exists().where(People.id == people_id)),
+            )
+        )
+        if result.rowcount:
+            db.session.execute(count_change(People, people_id, 1))
+            #los nombres para la respuesta, en la misma transaccion y por clave primaria
+            names = db.session.execute(names_statement(user_id, People.name, people_id)).first()
+            mark_changed(db.session, 'favorites', user_id)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({
+            'msg' : 'this character already exist'
+        }), 409
+
+    if not result.rowcount:
         return jsonify({'msg' : 'the character or the user not esxist :('}), 404
+
+    return jsonify({
+        'people_id' : people_id,
+        'people_fav_name' : names.name,
+        'user_name' : names.user_name,
+        'user_id' : user_id,
+    }), 200
     
 
 
-@app.route('/delete/favorites/user/<int:user_id>/people/<int:people_id>', methods=['DELETE'])
+@api.route('/delete/favorites/user/<int:user_id>/people/<int:people_id>', methods=['DELETE'])
 def delete_fav_people_by_id(user_id, people_id):
    
-   #hago una busqueda donde el people_id y el user_id esten en la misma fila
-    search_people_and_user_favorites_table = Favorites_People.query.filter_by( char_fav_id = people_id, user_id = user_id).first()
-
-    if search_people_and_user_favorites_table:
-
-        #guardo los cambios en la base de datos
-        db.session.delete(search_people_and_user_favorites_table)
+   #borro la fila donde el people_id y el user_id esten en la misma fila, sin buscarla antes
+    result = db.session.execute(
+        delete(Favorites_People)
+        .where(Favorites_People.char_fav_id == people_id, Favorites_People.user_id == user_id)
+        .execution_options(synchronize_session=False)
+    )
+
+    if result.rowcount:
+
+        #resto uno al contador y guardo los cambios en la base de datos
+        db.session.execute(count_change(People, people_id, -1))
+        mark_changed(db.session, 'favorites', user_id)
         db.session.commit()
         return jsonify({
             'msg' : 'character deleted!'
         }), 200
 
     else:
+        db.session.rollback()
         return jsonify({
             'msg' : 'this user or this character not exist'
         }), 404
@@ -473,4 +601,4 @@ def delete_fav_people_by_id(user_id, people_id):
 # this only runs if `$ python src/app.py` is executed
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 3000))
-    app.run(host='0.0.0.0', port=PORT, debug=False)
\ No newline at end of file
+    create_app().run(host='0.0.0.0', port=PORT, debug=False)
\ No newline at end of file
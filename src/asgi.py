@@ -0,0 +1,448 @@
+"""
+ASGI entry point. The read routes and the favorites routes run as coroutines on
+an AsyncSession, so one process keeps many of them waiting on the database at
+the same time; every other route (admin, bulk, create/edit, NDJSON exports) is
+served by the Flask app on a thread pool.
+
+    uvicorn asgi:application --app-dir src --workers 2
+"""
+import asyncio
+import contextvars
+import io
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from flask import Response
+from sqlalchemy import delete, exists, insert, literal, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import selectinload, sessionmaker
+from werkzeug.wrappers import Request
+from app import create_app
+from cache import backend, MemoryBackend, not_modified, response_key, scope_table, validators
+from changes import mark_changed
+from favorites import names_statement
+from multiget import body_ids, multi_get_body, multi_get_statements, parse_ids
+from models import User, People, Planets, Favorites_Planets, Favorites_People, Table_Version, serializer_for
+from pagination import page_body, page_query, wants_stream
+from pool import async_engine_options
+from popularity import count_change
+from search import list_filters, sort_param
+from utils import APIException
+import catalogue
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+    'mysql': 'mysql+aiomysql',
+}
+
+# threads running the Flask app for the routes without a coroutine
+FALLBACK_THREADS = int(os.getenv('ASGI_FALLBACK_THREADS', 16))
+
+
+def async_url(url):
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+
+
+app = create_app()
+database_url = app.config['SQLALCHEMY_DATABASE_URI']
+engine = create_async_engine(async_url(database_url), **async_engine_options(database_url))
+Session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+fallback_executor = ThreadPoolExecutor(FALLBACK_THREADS, thread_name_prefix='wsgi')
+
+_routes = []
+
+
+def route(rule, methods=('GET',)):
+    # rules are written like the Flask ones so the metrics keep the same labels
+    pattern = re.compile('^' + re.sub(r'<int:(\w+)>', r'(?P<\1>\\d+)', rule) + '/?$')
+
+    def decorator(handler):
+        _routes.append((pattern, methods, rule, handler))
+        return handler
+    return decorator
+
+
+def match(method, path):
+    for pattern, methods, rule, handler in _routes:
+        found = pattern.match(path)
+        if found and method in methods:
+            return rule, handler, {name: int(value) for name, value in found.groupdict().items()}
+    return None, None, None
+
+
+def json_response(body, status=200):
+    # same provider as jsonify, so both servers answer byte for byte the same
+    response = app.json.response(body)
+    response.status_code = status
+    return response
+
+
+async def cache_call(method, *args):
+    # the Redis client blocks on its socket: it runs on a thread, not on the loop
+    if isinstance(backend, MemoryBackend):
+        return method(*args)
+    return await asyncio.get_running_loop().run_in_executor(None, method, *args)
+
+
+async def read_through(req, session, table, scopes, view):
+    """ETag/Last-Modified of `table` and the shared response cache, like the
+    `conditional` and `cached_response` decorators do for the Flask views."""
+    current = await session.get(Table_Version, table) if table else None
+    if current is not None:
+        etag, last_modified = validators(current)
+        if not_modified(req, etag, last_modified):
+            response = Response(status=304)
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.vary.add('Accept')
+            return response
+
+    versions = {}
+    for name in {scope_table(scope) for scope in scopes}:
+        row = await session.get(Table_Version, name)
+        if row is not None:
+            versions[name] = row.version
+    key = response_key(scopes, req.full_path, versions)
+    body = await cache_call(backend.get, key) if key else None
+    if body is not None:
+        response = Response(body, mimetype='application/json')
+        response.cache_key = key
+    else:
+        response = await view()
+        if key and response.status_code == 200 and response.mimetype == 'application/json':
+            await cache_call(backend.set, key, response.get_data())
+            response.cache_key = key
+
+    if current is not None and response.status_code == 200:
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.vary.add('Accept')
+    return response
+
+
+async def catalogue_snapshot(session, model):
+    # the preloaded store loads through the sync side of the session
+    if not catalogue.ENABLED:
+        return None
+    return await session.run_sync(lambda sync_session: catalogue.snapshot(model, sync_session))
+
+
+async def multi_get(session, model, ids, fields):
+    serializer = serializer_for(model)
+    snapshot = await catalogue_snapshot(session, model)
+    if snapshot is not None:
+        return json_response(multi_get_body(snapshot.get_many(ids), ids, lambda row: serializer.dump(row, fields)))
+    rows = []
+    for stmt in multi_get_statements(model, serializer, fields, ids):
+        rows.extend((await session.execute(stmt)).all())
+    return json_response(multi_get_body(rows, ids, lambda row: serializer.dump(row, fields)))
+
+
+def list_route(rule, model, table):
+    serializer = serializer_for(model)
+
+    async def handler(req, session):
+        async def view():
+            fields = serializer.parse_fields(req.args.get('fields'))
+            if 'ids' in req.args:
+                return await multi_get(session, model, parse_ids(req.args['ids']), fields)
+            snapshot = await catalogue_snapshot(session, model)
+            if snapshot is not None:
+                return json_response(catalogue.list_page(snapshot, model, req.args, lambda row: serializer.dump(row, fields)))
+            sort = sort_param(model, req.args)
+            stmt = serializer.select(fields).where(*list_filters(model, req.args))
+            stmt, limit = page_query(stmt, model.id, req.args, sort)
+            rows = (await session.execute(stmt)).all()
+            return json_response(page_body(rows, model.id, limit, lambda row: serializer.dump(row, fields), sort))
+        return await read_through(req, session, table, [table], view)
+
+    route(rule)(handler)
+
+
+def batch_get_route(rule, model):
+    serializer = serializer_for(model)
+
+    async def handler(req, session):
+        fields = serializer.parse_fields(req.args.get('fields'))
+        return await multi_get(session, model, body_ids(req.get_json(silent=True)), fields)
+
+    route(rule, methods=('POST',))(handler)
+
+
+def detail_route(rule, model, table, missing):
+    serializer = serializer_for(model)
+
+    async def handler(req, session, **kwargs):
+        async def view():
+            fields = serializer.parse_fields(req.args.get('fields'))
+            item_id = next(iter(kwargs.values()))
+            snapshot = await catalogue_snapshot(session, model)
+            if snapshot is not None:
+                row = snapshot.get(item_id)
+            else:
+                row = (await session.execute(serializer.select(fields).where(model.id == item_id))).first()
+            if row:
+                return json_response(serializer.dump(row, fields))
+            return json_response({'msg': missing}, 404)
+        return await read_through(req, session, table, [table], view)
+
+    route(rule)(handler)
+
+
+list_route('/people', People, 'people')
+detail_route('/people/<int:char_id>', People, 'people', 'this character not exist :(')
+batch_get_route('/people/batch-get', People)
+list_route('/planets', Planets, 'planets')
+batch_get_route('/planets/batch-get', Planets)
+detail_route('/planets/<int:planet_id>', Planets, 'planets', 'That planet not exist :(')
+
+
+@route('/users')
+async def get_all_users(req, session):
+    users = serializer_for(User)
+    stmt, limit = page_query(users.select(), User.id, req.args)
+    rows = (await session.execute(stmt)).all()
+    return json_response(page_body(rows, User.id, limit, users.dump))
+
+
+@route('/user/<int:user_id>/favorites')
+async def get_all_favorites(req, session, user_id):
+    async def view():
+        user = (await session.execute(
+            select(User)
+            .options(selectinload(User.favorites_planets), selectinload(User.favorites_chars))
+            .where(User.id == user_id)
+        )).scalars().first()
+        if user is None:
+            return json_response({'msg': 'this user not exist :('}, 404)
+
+        planets = [{
+            'user_id': fav.user_id,
+            'user_name': user.user_name,
+            'planet_fav_id': fav.planet_fav_id,
+            'planet_name': fav.planets.planet_name,
+        } for fav in user.favorites_planets]
+        chars = [{
+            'user_id': fav.user_id,
+            'user_name': user.user_name,
+            'char_fav_id': fav.char_fav_id,
+            'char_name': fav.people.name,
+        } for fav in user.favorites_chars]
+
+        if not planets and not chars:
+            return json_response({'msg': 'this user dont have favorites planets and characters'}, 400)
+        return json_response({'planets_fav_list': planets, 'chars_fav_list': chars})
+
+    scopes = ['favorites:%d' % user_id, 'people', 'planets', 'user']
+    return await read_through(req, session, None, scopes, view)
+
+
+async def add_favorite(session, model, column, item_model, item_name, user_id, item_id):
+    """Same INSERT ... SELECT as the Flask views: None when it already existed,
+    otherwise (rows inserted, (user_name, item name) of the new favorite)."""
+    try:
+        result = await session.execute(
+            insert(model).from_select(
+                ['user_id', column],
+                select(User.id, literal(item_id)).where(User.id == user_id, exists().where(item_model.id == item_id)),
+            )
+        )
+        names = None
+        if result.rowcount:
+            await session.execute(count_change(item_model, item_id, 1))
+            names = (await session.execute(names_statement(user_id, item_name, item_id))).first()
+            mark_changed(session.sync_session, 'favorites', user_id)
+        await session.commit()
+    except IntegrityError:
+        await session.rollback()
+        return None
+    return result.rowcount, names
+
+
+async def delete_favorite(session, model, column, item_model, user_id, item_id):
+    result = await session.execute(
+        delete(model)
+        .where(getattr(model, column) == item_id, model.user_id == user_id)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount:
+        await session.execute(count_change(item_model, item_id, -1))
+        mark_changed(session.sync_session, 'favorites', user_id)
+        await session.commit()
+    else:
+        await session.rollback()
+    return result.rowcount
+
+
+@route('/user/<int:user_id>/favorites/planet/<int:planet_id>', methods=('POST',))
+async def add_fav_planet_by_id(req, session, user_id, planet_id):
+    added = await add_favorite(session, Favorites_Planets, 'planet_fav_id', Planets, Planets.planet_name, user_id, planet_id)
+    if added is None:
+        return json_response({'msg': 'that planet already exist'}, 409)
+    inserted, names = added
+    if not inserted:
+        return json_response({'msg': 'the planet or the user not esxist :('}, 404)
+    return json_response({
+        'planet_id': planet_id,
+        'planet_fav_name': names.planet_name,
+        'user_name': names.user_name,
+        'user_id': user_id,
+    })
+
+
+@route('/user/<int:user_id>/favorites/people/<int:people_id>', methods=('POST',))
+async def add_fav_people_by_id(req, session, user_id, people_id):
+    added = await add_favorite(session, Favorites_People, 'char_fav_id', People, People.name, user_id, people_id)
+    if added is None:
+        return json_response({'msg': 'this character already exist'}, 409)
+    inserted, names = added
+    if not inserted:
+        return json_response({'msg': 'the character or the user not esxist :('}, 404)
+    return json_response({
+        'people_id': people_id,
+        'people_fav_name': names.name,
+        'user_name': names.user_name,
+        'user_id': user_id,
+    })
+
+
+@route('/delete/favorites/user/<int:user_id>/planet/<int:planet_id>', methods=('DELETE',))
+async def delete_fav_planet_by_id(req, session, user_id, planet_id):
+    if await delete_favorite(session, Favorites_Planets, 'planet_fav_id', Planets, user_id, planet_id):
+        return json_response({'msg': 'planet deleted!'})
+    return json_response({'msg': 'this user or this planet not exist'}, 404)
+
+
+@route('/delete/favorites/user/<int:user_id>/people/<int:people_id>', methods=('DELETE',))
+async def delete_fav_people_by_id(req, session, user_id, people_id):
+    if await delete_favorite(session, Favorites_People, 'char_fav_id', People, user_id, people_id):
+        return json_response({'msg': 'character deleted!'})
+    return json_response({'msg': 'this user or this character not exist'}, 404)
+
+
+def wsgi_environ(scope, body):
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin1'),
+        'PATH_INFO': scope['path'].encode().decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('latin1'),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    server = scope.get('server') or ('localhost', 80)
+    environ['SERVER_NAME'], environ['SERVER_PORT'] = server[0], str(server[1] or 80)
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope['headers']:
+        name = name.decode('latin1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        value = value.decode('latin1')
+        environ[name] = environ[name] + ',' + value if name in environ else value
+    return environ
+
+
+async def call_wsgi(environ, send):
+    """Run the Flask app on the fallback pool, streaming its body chunk by chunk."""
+    loop = asyncio.get_running_loop()
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers]
+
+    def post(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    def run():
+        chunks = app.wsgi_app(environ, start_response)
+        try:
+            sent_start = False
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                if not sent_start:
+                    post({'type': 'http.response.start', 'status': started['status'], 'headers': started['headers']})
+                    sent_start = True
+                post({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if not sent_start:
+                post({'type': 'http.response.start', 'status': started['status'], 'headers': started['headers']})
+            post({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+    await loop.run_in_executor(fallback_executor, run)
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return body
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def send_response(send, response):
+    headers = [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in response.headers.items()]
+    await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': response.get_data()})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # warm start: the catalogue is in memory before the first request
+            catalogue.preload(app)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await engine.dispose()
+            fallback_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    body = await read_body(receive)
+    environ = wsgi_environ(scope, body)
+    path = scope['path'].rstrip('/') or '/'
+    _, handler, kwargs = match(scope['method'], path)
+    if handler is None or wants_stream(Request(environ)):
+        return await call_wsgi(environ, send)
+
+    # the request context gives the coroutine routes the same before/after_request
+    # hooks as the Flask views: CORS, metrics, Server-Timing and compression
+    with app.request_context(environ) as ctx:
+        try:
+            response = app.preprocess_request()
+            if response is not None:
+                response = app.make_response(response)
+            else:
+                async with Session() as session:
+                    response = await handler(ctx.request, session, **kwargs)
+        except APIException as error:
+            response = json_response(error.to_dict(), error.status_code)
+        # compression (and a Redis backed cache) would block the event loop
+        context = contextvars.copy_context()
+        response = await asyncio.get_running_loop().run_in_executor(None, context.run, app.process_response, response)
+    await send_response(send, response)
@@ -0,0 +1,154 @@
+"""
+Set based bulk create/upsert for the catalogue tables
+"""
+import importlib
+import json
+from flask import request
+from sqlalchemy import insert
+from changes import mark_changed
+from models import db, numeric_values, serializer_for, NUMERIC_FIELDS
+from utils import APIException
+
+# SQLite builds before 3.32 accept at most 999 bound parameters per statement
+MAX_PARAMETERS = 999
+
+
+def chunk_size(model, fields):
+    """Rows per multi-row INSERT: every column of every row is a bound parameter."""
+    columns = len(fields) + len(NUMERIC_FIELDS.get(model, ()))
+    return max(1, MAX_PARAMETERS // columns)
+
+
+def invalid_fields(item, fields):
+    """Error message for the fields of `item` that are missing or not a scalar; None if all are fine."""
+    missing = [name for name in fields if item.get(name) in (None, '')]
+    if missing:
+        return 'missing ' + ', '.join(missing)
+    # the columns are text: strings and numbers are accepted, lists, objects and booleans aren't
+    wrong = [name for name in fields
+             if not isinstance(item[name], (str, int, float)) or isinstance(item[name], bool)]
+    if wrong:
+        return 'must be a string or a number: ' + ', '.join(wrong)
+    return None
+
+
+def read_items():
+    """Yield (index, item) from a JSON array body or from an NDJSON stream.
+
+    NDJSON bodies are read line by line, so a large seed file is never held in
+    memory as a whole.
+    """
+    if request.mimetype == 'application/x-ndjson':
+        index = 0
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield index, json.loads(line)
+            except ValueError:
+                yield index, None
+            index += 1
+        return
+
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        raise APIException('the body must be a JSON array or an NDJSON stream', status_code=400)
+    yield from enumerate(items)
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def upsert_statement(model, key, rows, update):
+    """INSERT that ignores (or updates) rows whose unique key already exists."""
+    dialect = db.session.get_bind().dialect.name
+    columns = [name for name in rows[0] if name != key.key]
+    if dialect in ('postgresql', 'sqlite', 'mysql'):
+        # imported here: the engine has loaded its own dialect already, and the others
+        # are left out of the worker boot
+        insert_for_dialect = importlib.import_module('sqlalchemy.dialects.' + dialect).insert
+
+    if dialect in ('postgresql', 'sqlite'):
+        stmt = insert_for_dialect(model).values(rows)
+        if update:
+            return stmt.on_conflict_do_update(
+                index_elements=[key.key],
+                set_={name: stmt.excluded[name] for name in columns},
+            )
+        return stmt.on_conflict_do_nothing(index_elements=[key.key])
+
+    if dialect == 'mysql':
+        stmt = insert_for_dialect(model).values(rows)
+        if update:
+            return stmt.on_duplicate_key_update({name: stmt.inserted[name] for name in columns})
+        return stmt.prefix_with('IGNORE')
+
+    # other backends: the existence check already filtered the rows when not updating
+    return insert(model).values(rows)
+
+
+def bulk_upsert(model, key):
+    """Create (or with ?on_conflict=update, overwrite) many rows of `model`.
+
+    Every chunk costs one SELECT for the existing keys, one multi-row INSERT,
+    one SELECT for the ids and one commit, whatever its size; the response
+    reports what happened to each item by position.
+    """
+    on_conflict = request.args.get('on_conflict', 'skip')
+    if on_conflict not in ('skip', 'update'):
+        raise APIException('on_conflict must be skip or update', status_code=400)
+    update = on_conflict == 'update'
+
+    fields = [name for name in serializer_for(model).fields if name != 'id']
+    summary = {'created': 0, 'updated': 0, 'exists': 0, 'invalid': 0}
+    results = []
+
+    def report(result):
+        summary[result['status']] += 1
+        results.append(result)
+
+    for chunk in chunked(read_items(), chunk_size(model, fields)):
+        valid = {}
+        for index, item in chunk:
+            if not isinstance(item, dict):
+                report({'index': index, 'status': 'invalid', 'error': 'not a JSON object'})
+                continue
+            error = invalid_fields(item, fields)
+            if error:
+                report({'index': index, 'status': 'invalid', 'error': error})
+                continue
+            row = {field: str(item[field]) for field in fields}
+            name = row[key.key]
+            if name in valid:
+                report({'index': index, 'status': 'invalid', 'error': 'duplicated in this request'})
+                continue
+            # Core inserts skip the mapper events, so the numeric copies are filled here
+            row.update(numeric_values(model, row))
+            valid[name] = (index, row)
+
+        if valid:
+            existing = set(db.session.scalars(db.select(key).where(key.in_(list(valid)))))
+            rows = [row for name, (index, row) in valid.items() if update or name not in existing]
+            if rows:
+                db.session.execute(upsert_statement(model, key, rows, update))
+            ids = dict(db.session.execute(db.select(key, model.id).where(key.in_(list(valid)))).all())
+            for name, (index, row) in valid.items():
+                if name in existing:
+                    status = 'updated' if update else 'exists'
+                else:
+                    status = 'created'
+                if status != 'exists':
+                    mark_changed(db.session, model.__tablename__, ids.get(name))
+                report({'index': index, 'status': status, 'id': ids.get(name), key.key: name})
+            db.session.commit()
+
+    return dict(summary, results=sorted(results, key=lambda result: result['index']))
@@ -0,0 +1,344 @@
+"""
+Response cache with an in-memory and a Redis backend. Entries are keyed by the
+table_version rows of the tables they were read from, so every worker stops
+serving an entry as soon as a write commits, whatever the backend.
+"""
+import functools
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from datetime import timezone
+from urllib.parse import urlparse
+from flask import Response, make_response, request
+from metrics import Counter, Gauge
+from models import db, Table_Version
+from pagination import wants_stream
+
+DEFAULT_TTL = int(os.getenv('CACHE_TTL', 300))
+
+
+class LRUCache:
+    """Least-recently-used cache bounded by entries, bytes and age."""
+
+    def __init__(self, maxsize=1024, max_bytes=8 * 1024 * 1024, ttl=DEFAULT_TTL, sizeof=len):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._evict(key)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, key, value, ttl=None):
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._evict(key)
+            self._data[key] = (time.monotonic() + (ttl or self.ttl), size, value)
+            self._bytes += size
+            while len(self._data) > self.maxsize or self._bytes > self.max_bytes:
+                self._evict(next(iter(self._data)))
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._evict(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._data),
+                'bytes': self._bytes,
+            }
+
+    def _evict(self, key):
+        self._bytes -= self._data.pop(key)[1]
+
+
+class CacheBackend:
+    """Interface of a cache backend: byte values with a TTL."""
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=DEFAULT_TTL):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+
+class MemoryBackend(CacheBackend):
+    """Per-process backend: each worker fills its own copy."""
+
+    def __init__(self, maxsize=1024, max_bytes=32 * 1024 * 1024, ttl=DEFAULT_TTL):
+        self._values = LRUCache(maxsize=maxsize, max_bytes=max_bytes, ttl=ttl)
+
+    def get(self, key):
+        return self._values.get(key)
+
+    def set(self, key, value, ttl=DEFAULT_TTL):
+        self._values.set(key, value, ttl)
+
+    def delete(self, key):
+        self._values.delete(key)
+
+    def stats(self):
+        return self._values.stats()
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisBackend(CacheBackend):
+    """Minimal client for the Redis protocol (RESP2), one connection per thread.
+
+    Any network error is treated as a cache miss: the API keeps answering from
+    the database while the cache server is down.
+    """
+
+    def __init__(self, url, timeout=0.5):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._local = threading.local()
+
+    def get(self, key):
+        value = self._safe('GET', key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=DEFAULT_TTL):
+        self._safe('SET', key, value, 'EX', ttl)
+
+    def delete(self, key):
+        self._safe('DEL', key)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'errors': self.errors}
+
+    def _safe(self, *args):
+        try:
+            return self.execute(*args)
+        except (OSError, RedisError):
+            self.errors += 1
+            self._disconnect()
+            return None
+
+    def execute(self, *args):
+        self._connection().sendall(self._encode(args))
+        return self._read(self._local.reader)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            self._local.conn = conn
+            self._local.reader = conn.makefile('rb')
+            if self.password:
+                self.execute('AUTH', self.password)
+            if self.db:
+                self.execute('SELECT', self.db)
+        return conn
+
+    def _disconnect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+        self._local.__dict__.clear()
+
+    @staticmethod
+    def _encode(args):
+        out = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            out.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(out)
+
+    def _read(self, reader):
+        line = reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise RedisError('connection closed')
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload
+        if kind == b'-':
+            raise RedisError(payload.decode())
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            return [self._read(reader) for _ in range(int(payload))]
+        raise RedisError('unexpected reply %r' % line)
+
+
+def make_backend(url):
+    if url and url.startswith('redis://'):
+        return RedisBackend(url)
+    return MemoryBackend(
+        maxsize=int(os.getenv('CACHE_SIZE', 1024)),
+        max_bytes=int(os.getenv('CACHE_BYTES', 32 * 1024 * 1024)),
+    )
+
+
+backend = make_backend(os.getenv('CACHE_URL'))
+
+
+def _stat(name):
+    # read from whichever backend is current when /metrics renders
+    return lambda: backend.stats().get(name)
+
+
+Counter('cache_hits_total', 'Response cache lookups that found an entry', function=_stat('hits'))
+Counter('cache_misses_total', 'Response cache lookups that found nothing', function=_stat('misses'))
+Counter('cache_errors_total', 'Cache server errors, answered as misses (redis)', function=_stat('errors'))
+Gauge('cache_entries', 'Entries held by the in-memory cache', function=_stat('entries'))
+Gauge('cache_bytes', 'Bytes held by the in-memory cache', function=_stat('bytes'))
+
+
+def scope_table(scope):
+    # 'favorites:3' is versioned by the favorites row
+    return scope.split(':', 1)[0]
+
+
+def table_versions(scopes):
+    # `conditional` has usually loaded these rows already, then they cost no query
+    versions = {}
+    for table in {scope_table(scope) for scope in scopes}:
+        current = db.session.get(Table_Version, table)
+        if current is not None:
+            versions[table] = current.version
+    return versions
+
+
+def response_key(scopes, full_path, table_versions):
+    """Cache key of a body read at `table_versions`; None when a scope has no
+    version row, such a body can't be cached safely.
+
+    The versions are the rows the ETags come from, so a body is never stored or
+    served under a version other than the one it was read at.
+    """
+    try:
+        versions = ','.join('%s=%d' % (scope, table_versions[scope_table(scope)]) for scope in scopes)
+    except KeyError:
+        return None
+    return 'response:%s:%s' % (versions, full_path)
+
+
+def validators(current, stream=False):
+    """(ETag, Last-Modified) of a table from its version row."""
+    etag = '%s-%d%s' % (current.name, current.version, '-ndjson' if stream else '')
+    return etag, current.updated_at.replace(tzinfo=timezone.utc, microsecond=0)
+
+
+def not_modified(req, etag, last_modified):
+    if req.if_none_match:
+        # weak comparison (RFC 9110): compressed responses carry W/"<etag>"
+        return req.if_none_match.contains_weak(etag)
+    return req.if_modified_since is not None and req.if_modified_since >= last_modified
+
+
+def cached_response(*scopes):
+    """Cache the JSON body of a GET view under its URL and the version of every scope.
+
+    Scopes are formatted with the view arguments, e.g. 'favorites:{user_id}'.
+    A write bumps the version rows in its own transaction, so every worker
+    stops reading the old entries at the same time and they age out through
+    the TTL.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if wants_stream():
+                return view(*args, **kwargs)
+
+            names = [scope.format(**kwargs) for scope in scopes]
+            key = response_key(names, request.full_path, table_versions(names))
+            if key is None:
+                return view(*args, **kwargs)
+            body = backend.get(key)
+            if body is not None:
+                response = Response(body, mimetype='application/json')
+                response.cache_key = key
+                return response
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200 and response.mimetype == 'application/json':
+                backend.set(key, response.get_data())
+                # lets compression cache its output under the same versions
+                response.cache_key = key
+            return response
+        return wrapper
+    return decorator
+
+
+def conditional(table):
+    """Strong ETag and Last-Modified taken from the table version row.
+
+    The validators are checked against If-None-Match / If-Modified-Since before
+    the view runs, so an unchanged poll costs a single primary key lookup.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            current = db.session.get(Table_Version, table)
+            if current is None:
+                return view(*args, **kwargs)
+
+            etag, last_modified = validators(current, wants_stream())
+            if not_modified(request, etag, last_modified):
+                response = Response(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.vary.add('Accept')
+            return response
+        return wrapper
+    return decorator
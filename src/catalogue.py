@@ -0,0 +1,199 @@
+"""
+Optional in-memory copy of the people and planets tables (CATALOGUE_PRELOAD=1).
+
+Each worker reads from an immutable snapshot: one `__slots__` record per row
+in a map by id, the ids in order and the numeric copies of the sortable
+columns. A snapshot is checked against the table version row (the one the
+ETags come from), so a write made by any worker is seen on the next read, and
+a commit in this worker drops it right away. With `gunicorn --preload` the
+snapshots are loaded once in the master and the workers share those pages
+copy-on-write.
+
+Detail, multi-get and list pages (filters, sort and cursors included) are
+answered from it. Search and the popular leaderboards still rank in the
+database (the index, the favorite counters) and read the rows from here; the
+NDJSON export keeps streaming from the table.
+"""
+import bisect
+import gc
+import os
+import threading
+from changes import subscribe
+from models import db, People, Planets, Table_Version, NUMERIC_FIELDS, serializer_for
+from pagination import encode_cursor, page_size, read_cursor
+from search import FACETS, facet_values, numeric_bounds, sort_param
+
+ENABLED = os.getenv('CATALOGUE_PRELOAD', '').lower() in ('1', 'true', 'yes')
+
+
+class Record:
+    """Read-only row; subclasses list the serializer fields in `__slots__`."""
+    __slots__ = ()
+
+    def __init__(self, values):
+        for name, value in zip(self.__slots__, values):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('catalogue records are read-only')
+
+
+class Snapshot:
+    __slots__ = ('version', 'records', 'ids', 'numbers', '_orders')
+
+    def __init__(self, version, records, numbers):
+        self.version = version
+        self.records = records
+        self.ids = tuple(sorted(records))
+        # {'height': {id: height_num}}, the values the table sorts and filters on
+        self.numbers = numbers
+        self._orders = {}
+
+    def get(self, item_id):
+        return self.records.get(item_id)
+
+    def get_many(self, ids):
+        return [self.records[item_id] for item_id in ids if item_id in self.records]
+
+    @staticmethod
+    def sort_key(value, item_id, descending):
+        # the ORDER BY of a sorted page: NULLs last, then the value and the id in one direction
+        sign = -1 if descending else 1
+        return (value is None, 0 if value is None else sign * value, sign * item_id)
+
+    def order(self, field, descending):
+        """(sort keys, ids) of every row ordered by `field`, built on first use."""
+        order = self._orders.get((field, descending))
+        if order is None:
+            values = self.numbers[field]
+            keys = sorted(self.sort_key(values[item_id], item_id, descending) for item_id in self.ids)
+            sign = -1 if descending else 1
+            # derived from the rows, so two threads building it at once build the same thing
+            order = self._orders[field, descending] = (keys, tuple(sign * key[2] for key in keys))
+        return order
+
+
+class CatalogueStore:
+    def __init__(self, model):
+        self.model = model
+        self.table = model.__tablename__
+        self.serializer = serializer_for(model)
+        self.record = type(model.__name__ + 'Record', (Record,), {'__slots__': self.serializer.fields})
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def snapshot(self, session):
+        """The snapshot for the version `session` sees, loaded again when the
+        table moved; None when the table has no version row."""
+        current = session.get(Table_Version, self.table)
+        if current is None:
+            return None
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.version != current.version:
+            with self._lock:
+                snapshot = self._snapshot
+                if snapshot is None or snapshot.version != current.version:
+                    snapshot = self._snapshot = self._load(session, current.version)
+        return snapshot
+
+    def invalidate(self):
+        self._snapshot = None
+
+    def _load(self, session, version):
+        fields = NUMERIC_FIELDS[self.model]
+        stmt = self.serializer.select().add_columns(*[getattr(self.model, field + '_num') for field in fields])
+        records, numbers = {}, {field: {} for field in fields}
+        width = len(self.serializer.fields)
+        for row in session.execute(stmt):
+            record = self.record(row[:width])
+            records[record.id] = record
+            for field, value in zip(fields, row[width:]):
+                numbers[field][record.id] = value
+        # built aside and swapped in one go, readers never see a half loaded table
+        return Snapshot(version, records, numbers)
+
+
+stores = {model: CatalogueStore(model) for model in (People, Planets)}
+
+
+def snapshot(model, session=None):
+    """Snapshot of `model` when the preloaded mode is on, None otherwise.
+
+    The async server passes the sync side of its session through `run_sync`.
+    """
+    if not ENABLED:
+        return None
+    return stores[model].snapshot(db.session if session is None else session)
+
+
+def list_page(snapshot, model, args, dump):
+    """GET /people or /planets read from `snapshot`: the same filters, order,
+    page size and cursors as `paginate` over the table.
+
+    The cursor is found with a binary search over the ids (or the sort keys),
+    and rows are filtered from there until the page is full.
+    """
+    facets = facet_values(args, FACETS[model.__tablename__])
+    bounds = numeric_bounds(model, args)
+    sort = sort_param(model, args)
+    limit = page_size(args)
+    after = read_cursor(args, sort)
+
+    if sort is None:
+        ids = snapshot.ids
+        start = 0 if after is None else bisect.bisect_right(ids, after)
+        cursor = lambda item_id: item_id
+    else:
+        column, descending, _ = sort
+        field = column.key[:-len('_num')]
+        keys, ids = snapshot.order(field, descending)
+        start = 0 if after is None else bisect.bisect_right(keys, snapshot.sort_key(after[0], after[1], descending))
+        cursor = lambda item_id: [snapshot.numbers[field][item_id], item_id]
+
+    def matches(item_id):
+        record = snapshot.records[item_id]
+        for name, values in facets.items():
+            if getattr(record, name) not in values:
+                return False
+        for name, prefix, bound in bounds:
+            value = snapshot.numbers[name][item_id]
+            if value is None or (value < bound if prefix == 'min_' else value > bound):
+                return False
+        return True
+
+    page = []
+    for index in range(start, len(ids)):
+        if (facets or bounds) and not matches(ids[index]):
+            continue
+        page.append(ids[index])
+        if len(page) > limit:
+            break
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_cursor(cursor(page[-1]))
+    return {
+        'results': [dump(snapshot.records[item_id]) for item_id in page],
+        'next': next_cursor,
+    }
+
+
+def preload(app):
+    """Load every table before the workers fork."""
+    if not ENABLED:
+        return
+    with app.app_context():
+        for store in stores.values():
+            store.snapshot(db.session)
+        db.session.remove()
+        # the workers open their own connections instead of sharing the master's
+        db.engine.dispose()
+    # keeps the collector of each worker from touching (and so copying) the shared pages
+    gc.freeze()
+
+
+@subscribe
+def _drop_snapshots(changes):
+    for store in stores.values():
+        if changes.get(store.table):
+            store.invalidate()
@@ -0,0 +1,69 @@
+"""
+Collects the rows touched by a transaction, bumps the table versions inside it
+and notifies subscribers once it commits
+"""
+from datetime import datetime
+from sqlalchemy import event, update
+from sqlalchemy.orm import Session, object_session
+from models import User, People, Planets, Favorites_Planets, Favorites_People, Table_Version, VERSIONED_TABLES
+
+_subscribers = []
+
+
+def subscribe(callback):
+    # callback(changes) is called after every commit with {table_name: set(ids)}
+    _subscribers.append(callback)
+    return callback
+
+
+def mark_changed(session, table, key):
+    # writes issued as plain SQL statements don't go through the mapper events,
+    # so their handlers have to declare what they touched
+    session.info.setdefault('changes', {}).setdefault(table, set()).add(key)
+
+
+def _record_entity(mapper, connection, target):
+    session = object_session(target)
+    mark_changed(session, target.__tablename__, target.id)
+    # favorites are also tracked by owner so per-user data can be invalidated
+    if isinstance(target, (Favorites_Planets, Favorites_People)):
+        mark_changed(session, 'favorites', target.user_id)
+
+
+for model in (User, People, Planets, Favorites_Planets, Favorites_People):
+    for name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(model, name, _record_entity)
+
+
+def _bump_table_versions(session):
+    # one bump per table and transaction is enough for the validators to change
+    bumped = session.info.setdefault('bumped', set())
+    tables = [name for name in VERSIONED_TABLES if name in session.info.get('changes', {}) and name not in bumped]
+    if tables:
+        session.connection().execute(
+            update(Table_Version)
+            .where(Table_Version.name.in_(tables))
+            .values(version=Table_Version.version + 1, updated_at=datetime.utcnow())
+        )
+        bumped.update(tables)
+
+
+# the mapper events fire during the flush, and plain SQL writes mark their rows
+# before commit; between both hooks every change is versioned in its transaction
+event.listen(Session, 'after_flush', lambda session, flush_context: _bump_table_versions(session))
+event.listen(Session, 'before_commit', _bump_table_versions)
+
+
+@event.listens_for(Session, 'after_commit')
+def _notify(session):
+    session.info.pop('bumped', None)
+    changes = session.info.pop('changes', None)
+    if changes:
+        for callback in _subscribers:
+            callback(changes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard(session):
+    session.info.pop('bumped', None)
+    session.info.pop('changes', None)
@@ -0,0 +1,158 @@
+"""
+Response compression negotiated through Accept-Encoding (zstd, br, gzip).
+
+Small bodies are sent as they are, streamed bodies are compressed chunk by
+chunk, and bodies served from the response cache keep their compressed form
+in the cache next to them, so a hot list is compressed once per version.
+"""
+import os
+import zlib
+from flask import request
+from cache import backend
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - zstandard is optional
+    zstandard = None
+
+# bodies under this many bytes cost more to compress than they save
+MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', 5))
+ZSTD_LEVEL = int(os.getenv('COMPRESS_ZSTD_LEVEL', 3))
+# a streamed body is flushed to the client every this many input bytes
+STREAM_FLUSH_BYTES = 16 * 1024
+
+COMPRESSIBLE = {
+    'application/json', 'application/x-ndjson', 'application/javascript',
+    'text/html', 'text/plain', 'text/css', 'image/svg+xml',
+}
+
+_available = {'gzip': True, 'br': brotli is not None, 'zstd': zstandard is not None}
+# server preference when the client accepts several with the same quality
+ENCODINGS = [name for name in os.getenv('COMPRESS_ENCODINGS', 'zstd,br,gzip').split(',') if _available.get(name)]
+
+
+def compress(data, encoding):
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        return compressor.compress(data) + compressor.flush()
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+
+
+class StreamCompressor:
+    """Same codecs for a body produced chunk by chunk."""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'gzip':
+            self._obj = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        elif encoding == 'br':
+            self._obj = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._obj = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+    def compress(self, chunk):
+        if self.encoding == 'br':
+            return self._obj.process(chunk)
+        return self._obj.compress(chunk)
+
+    def flush(self):
+        # emits everything compressed so far without ending the stream
+        if self.encoding == 'gzip':
+            return self._obj.flush(zlib.Z_SYNC_FLUSH)
+        if self.encoding == 'br':
+            return self._obj.flush()
+        return self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._obj.finish()
+        return self._obj.flush()
+
+
+def compress_stream(chunks, encoding):
+    compressor = StreamCompressor(encoding)
+    pending = 0
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            out = compressor.compress(chunk)
+            pending += len(chunk)
+            if pending >= STREAM_FLUSH_BYTES:
+                out += compressor.flush()
+                pending = 0
+            if out:
+                yield out
+        yield compressor.finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def negotiate(req):
+    return req.accept_encodings.best_match(ENCODINGS) if ENCODINGS else None
+
+
+def weaken_etag(response):
+    # compressed bytes are another representation of the body: the validator becomes weak
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+
+def compress_response(req, response):
+    """Compress `response` in place for `req` when it is worth it.
+
+    A response built by `cached_response` carries its cache key, and its
+    compressed body is cached under that key plus the encoding.
+    """
+    if response.mimetype not in COMPRESSIBLE or response.direct_passthrough:
+        return response
+    response.vary.add('Accept-Encoding')
+    if response.status_code == 304:
+        # stands for the 200 the client holds: with an encoding negotiated it carried W/"<etag>"
+        if req.method != 'HEAD' and negotiate(req) is not None:
+            weaken_etag(response)
+        return response
+    if response.status_code != 200 or req.method == 'HEAD' or 'Content-Encoding' in response.headers:
+        return response
+
+    encoding = negotiate(req)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < MIN_SIZE:
+            # same validator as the 304 of a client that accepts an encoding
+            weaken_etag(response)
+            return response
+        key = getattr(response, 'cache_key', None)
+        body = backend.get('%s|%s' % (key, encoding)) if key else None
+        if body is None:
+            body = compress(data, encoding)
+            if key:
+                backend.set('%s|%s' % (key, encoding), body)
+        response.set_data(body)
+
+    response.headers['Content-Encoding'] = encoding
+    weaken_etag(response)
+    return response
+
+
+def init_app(app):
+    @app.after_request
+    def compress_after_request(response):
+        return compress_response(request, response)
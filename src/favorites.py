@@ -0,0 +1,156 @@
+"""
+Batch add/remove of a user's favorites: one query reads everything the batch
+refers to, one transaction applies the net changes
+"""
+from sqlalchemy import delete, insert, literal, select, union_all
+from changes import mark_changed
+from models import db, User, People, Planets, Favorites_Planets, Favorites_People
+from popularity import count_change
+from utils import APIException
+
+MAX_OPERATIONS = 1000
+
+# operation type -> (item model, favorites model, favorites column pointing to the item)
+KINDS = {
+    'planet': (Planets, Favorites_Planets, Favorites_Planets.planet_fav_id),
+    'people': (People, Favorites_People, Favorites_People.char_fav_id),
+}
+OPERATIONS = ('add', 'remove')
+
+
+def names_statement(user_id, item_name, item_id):
+    """SELECT of the user's name and the item's name (columns named like the
+    models'), two primary key lookups in one statement."""
+    item_model = item_name.class_
+    return select(
+        select(User.user_name).where(User.id == user_id).scalar_subquery().label('user_name'),
+        select(item_name).where(item_model.id == item_id).scalar_subquery().label(item_name.key),
+    )
+
+
+def parse_operations(body):
+    """Yield (index, op, kind, id, error) for every operation of the body."""
+    if isinstance(body, dict):
+        body = body.get('operations')
+    if not isinstance(body, list):
+        raise APIException('the body must be a list of operations', status_code=400)
+    if len(body) > MAX_OPERATIONS:
+        raise APIException('at most %d operations per request' % MAX_OPERATIONS, status_code=400)
+
+    for index, item in enumerate(body):
+        if not isinstance(item, dict):
+            yield index, None, None, None, 'not a JSON object'
+            continue
+        op, kind, item_id = item.get('op'), item.get('type'), item.get('id')
+        if op not in OPERATIONS:
+            error = 'op must be add or remove'
+        elif kind not in KINDS:
+            error = 'type must be planet or people'
+        elif not isinstance(item_id, int) or isinstance(item_id, bool):
+            error = 'id must be an integer'
+        else:
+            error = None
+        yield index, op, kind, item_id, error
+
+
+def current_state(user_id, ids):
+    """The user, the referenced items that exist and the user's favorites among
+    them, read with a single UNION ALL."""
+    parts = [select(literal('user').label('source'), User.id.label('id')).where(User.id == user_id)]
+    for kind, (model, favorites, column) in KINDS.items():
+        if ids[kind]:
+            parts.append(select(literal(kind), model.id).where(model.id.in_(ids[kind])))
+            parts.append(
+                select(literal('favorite ' + kind), column)
+                .where(favorites.user_id == user_id, column.in_(ids[kind]))
+            )
+    found = {'user': set()}
+    for kind in KINDS:
+        found[kind] = set()
+        found['favorite ' + kind] = set()
+    for source, item_id in db.session.execute(union_all(*parts)):
+        found[source].add(item_id)
+    return found
+
+
+def delete_favorites(favorites, column, user_id, item_ids):
+    """Delete the user's favorites of `item_ids`; {item id: rows deleted}.
+
+    What a concurrent request removed first isn't in the result, so the
+    counters are only decremented for the rows this transaction deleted.
+    """
+    deleted = {}
+    if db.session.get_bind().dialect.full_returning:
+        rows = db.session.execute(
+            delete(favorites)
+            .where(favorites.user_id == user_id, column.in_(item_ids))
+            .returning(column)
+            .execution_options(synchronize_session=False)
+        )
+        for item_id, in rows:
+            deleted[item_id] = deleted.get(item_id, 0) + 1
+        return deleted
+    # without DELETE ... RETURNING (sqlite, mysql) the rowcount of each id tells
+    for item_id in item_ids:
+        result = db.session.execute(
+            delete(favorites)
+            .where(favorites.user_id == user_id, column == item_id)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount:
+            deleted[item_id] = result.rowcount
+    return deleted
+
+
+def apply_operations(user_id, body):
+    """Run the add/remove operations of `body` for the user; None if the user doesn't exist.
+
+    Operations are applied in order against the state read at the start, so
+    only the net change reaches the database: one INSERT and one DELETE per
+    type, the popularity counters, and a single commit.
+    """
+    operations = list(parse_operations(body))
+    ids = {kind: {item_id for _, _, op_kind, item_id, error in operations if op_kind == kind and not error}
+           for kind in KINDS}
+    found = current_state(user_id, ids)
+    if user_id not in found['user']:
+        return None
+
+    state = {kind: set(found['favorite ' + kind]) for kind in KINDS}
+    summary = {'added': 0, 'removed': 0, 'exists': 0, 'not_found': 0, 'invalid': 0}
+    results = []
+    for index, op, kind, item_id, error in operations:
+        if error:
+            status = 'invalid'
+        elif item_id not in found[kind]:
+            status = 'not_found'
+        elif op == 'add':
+            status = 'exists' if item_id in state[kind] else 'added'
+            state[kind].add(item_id)
+        else:
+            status = 'removed' if item_id in state[kind] else 'not_found'
+            state[kind].discard(item_id)
+        summary[status] += 1
+        result = {'index': index, 'op': op, 'type': kind, 'id': item_id, 'status': status}
+        if error:
+            result['error'] = error
+        results.append(result)
+
+    changed = False
+    for kind, (model, favorites, column) in KINDS.items():
+        added = state[kind] - found['favorite ' + kind]
+        removed = found['favorite ' + kind] - state[kind]
+        if added:
+            db.session.execute(insert(favorites), [{'user_id': user_id, column.key: item_id} for item_id in sorted(added)])
+            db.session.execute(count_change(model, sorted(added), 1))
+        if removed:
+            deleted = delete_favorites(favorites, column, user_id, sorted(removed))
+            # one UPDATE per distinct number of rows deleted, usually a single one
+            for rows in set(deleted.values()):
+                db.session.execute(count_change(model, sorted(item_id for item_id, count in deleted.items() if count == rows), -rows))
+        changed = changed or bool(added or removed)
+
+    if changed:
+        mark_changed(db.session, 'favorites', user_id)
+    db.session.commit()
+    return dict(summary, results=results)
@@ -0,0 +1,69 @@
+"""
+JSON encoding with orjson when it is installed and the standard library otherwise.
+
+Both paths write what jsonify always wrote: sorted keys, compact separators and
+non-ASCII (and DEL) escaped as \\uXXXX. orjson writes raw UTF-8, so a body with
+such characters goes through the standard library instead. Floats only differ
+in exponent notation (1e16 vs 1e+16), and no API payload carries floats.
+"""
+import json
+import time
+from monitoring import TimedJSONProvider, record_serialize_time
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+if orjson is not None:
+    ORJSON_OPTIONS = (
+        orjson.OPT_SORT_KEYS
+        | orjson.OPT_NON_STR_KEYS
+        # these types are left to `default`, so they look like they did with jsonify
+        | orjson.OPT_PASSTHROUGH_DATETIME
+        | orjson.OPT_PASSTHROUGH_DATACLASS
+        | orjson.OPT_PASSTHROUGH_SUBCLASS
+    )
+
+
+def dumps_bytes(obj, default=None):
+    """Compact, key sorted, ASCII JSON of `obj` as bytes."""
+    if orjson is not None:
+        try:
+            body = orjson.dumps(obj, default=default, option=ORJSON_OPTIONS)
+            # the standard library also escapes DEL (0x7f)
+            if body.isascii() and b'\x7f' not in body:
+                return body
+        except TypeError:
+            # e.g. integers wider than 64 bits; the standard library handles them
+            pass
+    return json.dumps(obj, default=default, sort_keys=True, separators=(',', ':')).encode()
+
+
+class FastJSONProvider(TimedJSONProvider):
+    """Flask JSON provider that encodes responses with `dumps_bytes`."""
+
+    def _compact(self):
+        # debug mode pretty prints like the default provider
+        return self.compact or (self.compact is None and not self._app.debug)
+
+    def dumps(self, obj, **kwargs):
+        # only the compact form jsonify asks for; anything else keeps the stdlib behaviour
+        if kwargs != {'separators': (',', ':')} or not self.sort_keys or not self.ensure_ascii:
+            return super().dumps(obj, **kwargs)
+        start = time.perf_counter()
+        try:
+            return dumps_bytes(obj, self.default).decode()
+        finally:
+            record_serialize_time(start)
+
+    def response(self, *args, **kwargs):
+        if not self._compact() or not self.sort_keys or not self.ensure_ascii:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        start = time.perf_counter()
+        try:
+            body = dumps_bytes(obj, self.default)
+        finally:
+            record_serialize_time(start)
+        return self._app.response_class(body + b'\n', mimetype=self.mimetype)
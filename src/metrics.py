@@ -0,0 +1,212 @@
+"""
+Minimal Prometheus metrics: counters, gauges and histograms rendered as text
+
+With METRICS_DIR set (one directory shared by all the gunicorn workers) every
+process periodically dumps its samples to METRICS_DIR/metrics_<pid>.json and
+/metrics adds up the files of all the workers, whichever worker serves it.
+"""
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+REGISTRY = []
+
+MULTIPROCESS_DIR = os.getenv('METRICS_DIR')
+FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 1.0))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in labels) + '}'
+
+
+class Metric:
+    """Base of the metrics; with `function` the value is read when rendering
+    instead of being recorded (None leaves the sample out)."""
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        if self.function is not None:
+            value = self.function()
+            return [] if value is None else [(self.name, (), value)]
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s %s' % (self.name, self.kind)]
+        for name, labels, value in self.samples():
+            lines.append('%s%s %s' % (name, _format_labels(labels), _format_value(value)))
+        return '\n'.join(lines)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(Metric):
+    """A counter incremented explicitly or, with `function`, a running total
+    kept elsewhere (e.g. the hits of a cache)."""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A gauge set explicitly or, with `function`, read when rendering."""
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                for bound, count in zip(self.buckets, counts):
+                    samples.append((self.name + '_bucket', key + (('le', _format_value(bound)),), count))
+                samples.append((self.name + '_sum', key, total))
+                samples.append((self.name + '_count', key, counts[-1]))
+        return samples
+
+
+def _process_file(pid):
+    return os.path.join(MULTIPROCESS_DIR, 'metrics_%d.json' % pid)
+
+
+_last_flush = [0.0]
+_trailing = [None]
+_flush_lock = threading.Lock()
+
+
+def flush(force=False):
+    """Write this process' samples to its file in METRICS_DIR (at most once per interval).
+
+    A call within the interval schedules a trailing flush at its end instead,
+    so the last requests of a worker that goes idle still reach the file.
+    """
+    if not MULTIPROCESS_DIR:
+        return
+    with _flush_lock:
+        wait = FLUSH_INTERVAL - (time.monotonic() - _last_flush[0])
+        if not force and wait > 0:
+            if _trailing[0] is None:
+                timer = threading.Timer(wait, _trailing_flush)
+                timer.daemon = True
+                _trailing[0] = timer
+                timer.start()
+            return
+        _last_flush[0] = time.monotonic()
+        data = {metric.name: [[name, list(labels), value] for name, labels, value in metric.samples()] for metric in REGISTRY}
+        path = _process_file(os.getpid())
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as fp:
+            json.dump(data, fp)
+        os.replace(tmp, path)
+
+
+def _trailing_flush():
+    with _flush_lock:
+        _trailing[0] = None
+    flush(force=True)
+
+
+def _after_fork():
+    # the timer thread of the parent (gunicorn --preload) doesn't exist in the child
+    global _flush_lock
+    _flush_lock = threading.Lock()
+    _trailing[0] = None
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _merged_samples():
+    flush(force=True)
+    merged = {metric.name: {} for metric in REGISTRY}
+    kinds = {metric.name: metric.kind for metric in REGISTRY}
+    for path in glob.glob(os.path.join(MULTIPROCESS_DIR, 'metrics_*.json')):
+        pid = int(os.path.basename(path)[len('metrics_'):-len('.json')])
+        try:
+            with open(path) as fp:
+                data = json.load(fp)
+        except (OSError, ValueError):
+            continue
+        alive = _alive(pid)
+        for metric_name, samples in data.items():
+            # counters of a dead worker still count, its gauges don't
+            if metric_name not in merged or (kinds[metric_name] == 'gauge' and not alive):
+                continue
+            for name, labels, value in samples:
+                key = (name, tuple(tuple(label) for label in labels))
+                merged[metric_name][key] = merged[metric_name].get(key, 0) + value
+    return merged
+
+
+def render():
+    if not MULTIPROCESS_DIR:
+        return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+    merged = _merged_samples()
+    lines = []
+    for metric in REGISTRY:
+        lines.append('# HELP %s %s' % (metric.name, metric.documentation))
+        lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+        for (name, labels), value in merged[metric.name].items():
+            lines.append('%s%s %s' % (name, _format_labels(labels), _format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+
+if MULTIPROCESS_DIR:
+    atexit.register(flush, force=True)
+    os.register_at_fork(after_in_child=_after_fork)
@@ -1,4 +1,8 @@
+import math
+from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from utils import APIException
 
 db = SQLAlchemy()
 
@@ -7,10 +11,28 @@ class User(db.Model):
     user_name = db.Column(db.String(120), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password = db.Column(db.String(80), unique=False, nullable=False) 
-    favorites_planets = db.relationship('Favorites_Planets', backref='user', lazy=True)
-    favorites_chars = db.relationship('Favorites_People', backref='user', lazy=True)
+    # las colecciones de favoritos se cargan bajo demanda; quien necesite recorrerlas
+    # debe pedir selectinload() para no disparar una consulta por fila
+    favorites_planets = db.relationship('Favorites_Planets', backref=db.backref('user', lazy='select'), lazy='select')
+    favorites_chars = db.relationship('Favorites_People', backref=db.backref('user', lazy='select'), lazy='select')
+
+    def __repr__(self):
+        return '<User %r>' % self.id
+
+    def serialize(self):
+        return serializer_for(User).dump(self)
 
 class People(db.Model):
+    # indices (faceta, id) para filtrar la lista sin perder el orden del cursor
+    __table_args__ = (
+        db.Index('ix_people_gender_id', 'gender', 'id'),
+        db.Index('ix_people_eye_color_id', 'eye_color', 'id'),
+        db.Index('ix_people_hair_color_id', 'hair_color', 'id'),
+        db.Index('ix_people_skin_color_id', 'skin_color', 'id'),
+        db.Index('ix_people_height_num_id', 'height_num', 'id'),
+        db.Index('ix_people_mass_num_id', 'mass_num', 'id'),
+        db.Index('ix_people_favorite_count_id', 'favorite_count', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(50), unique=True, nullable=False)
     height = db.Column(db.String(20), unique=False, nullable=False)
@@ -20,9 +42,31 @@ class People(db.Model):
     hair_color = db.Column(db.String(50), unique=False, nullable=False)
     birth_year = db.Column(db.String(50), unique=False, nullable=False)
     gender = db.Column(db.String(50), unique=False, nullable=False)
-    favorite = db.relationship('Favorites_People', backref='people', lazy=True)
+    # copias numericas de height y mass ("1,000" -> 1000, "unknown" -> NULL) para ordenar y filtrar en SQL
+    height_num = db.Column(db.Float, nullable=True)
+    mass_num = db.Column(db.Float, nullable=True)
+    # cuantos usuarios lo tienen en favoritos; lo mantienen las escrituras de favoritos (ver popularity.py)
+    favorite_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # cada favorito trae su personaje en el mismo SELECT (LEFT OUTER JOIN)
+    favorite = db.relationship('Favorites_People', backref=db.backref('people', lazy='joined'), lazy='select')
+
+    def __repr__(self):
+        return '<People %r>' % self.id
+
+    def serialize(self):
+        return serializer_for(People).dump(self)
 
 class Planets (db.Model):
+    __table_args__ = (
+        db.Index('ix_planets_climate_id', 'climate', 'id'),
+        db.Index('ix_planets_terrain_id', 'terrain', 'id'),
+        db.Index('ix_planets_rotation_period_num_id', 'rotation_period_num', 'id'),
+        db.Index('ix_planets_orbital_period_num_id', 'orbital_period_num', 'id'),
+        db.Index('ix_planets_diameter_num_id', 'diameter_num', 'id'),
+        db.Index('ix_planets_surface_water_num_id', 'surface_water_num', 'id'),
+        db.Index('ix_planets_population_num_id', 'population_num', 'id'),
+        db.Index('ix_planets_favorite_count_id', 'favorite_count', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     planet_name = db.Column(db.String(50), unique=True, nullable=False)
     rotation_period = db.Column(db.String(20), unique=False, nullable=False)
@@ -33,73 +77,156 @@ class Planets (db.Model):
     terrain = db.Column(db.String(20), unique=False, nullable=False)
     surface_water = db.Column(db.String(20), unique=False, nullable=False)
     population = db.Column(db.String(20), unique=False, nullable=False)
-    favorite = db.relationship('Favorites_Planets', backref='planets', lazy=True)
+    rotation_period_num = db.Column(db.Float, nullable=True)
+    orbital_period_num = db.Column(db.Float, nullable=True)
+    diameter_num = db.Column(db.Float, nullable=True)
+    surface_water_num = db.Column(db.Float, nullable=True)
+    population_num = db.Column(db.Float, nullable=True)
+    favorite_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # cada favorito trae su planeta en el mismo SELECT (LEFT OUTER JOIN)
+    favorite = db.relationship('Favorites_Planets', backref=db.backref('planets', lazy='joined'), lazy='select')
+
+    def __repr__(self):
+        return '<Planets %r>' % self.id
+
+    def serialize(self):
+        return serializer_for(Planets).dump(self)
 
 class Favorites_Planets (db.Model):
+    # un usuario no puede repetir un planeta; el indice unico tambien sirve para
+    # listar los favoritos de un usuario (user_id es la primera columna)
+    __table_args__ = (
+        db.Index('ix_favorites__planets_user_id_planet_fav_id', 'user_id', 'planet_fav_id', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id =  db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    planet_fav_id = db.Column(db.Integer, db.ForeignKey('planets.id'), nullable=False)
+    planet_fav_id = db.Column(db.Integer, db.ForeignKey('planets.id'), nullable=False, index=True)
+
+    def __repr__(self):
+        return '<Favorites_Planets %r>' % self.id
+
+    def serialize(self):
+        return serializer_for(Favorites_Planets).dump(self)
 
 class Favorites_People (db.Model):
+    __table_args__ = (
+        db.Index('ix_favorites__people_user_id_char_fav_id', 'user_id', 'char_fav_id', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id =  db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    char_fav_id = db.Column(db.Integer, db.ForeignKey('people.id'), nullable=False)
+    char_fav_id = db.Column(db.Integer, db.ForeignKey('people.id'), nullable=False, index=True)
 
-
-    def __repr__(self):
-        return '<User %r>' % self.id
-    
     def __repr__(self):
-        return '<People %r>' % self.id 
-    
-    def __repr__(self):
-        return '<Planets %r>' % self.id 
-    
-    def __repr__(self):
-        return '<Favorites_Planets %r>' %self.id
-    
-    def __repr__(self):
-        return '<Favorites_People %r>' %self.id
+        return '<Favorites_People %r>' % self.id
 
     def serialize(self):
-        return {
-            #serializacion de la tabla users
-            "id": self.id,
-            "user_name" : self.user_name,
-            "email": self.email, 
-     
-            #serializacion de la tabla people 
-            "people_id" : self.people_id,
-            "people_name": self.people_name,
-            "eye_color": self.eye_color,
-            "skin_color" : self.skin_color,
-            "height" :  self.height,
-            "mass" : self.mass,
-            "hair_color" : self.hair_color,
-            "birth_year" : self.birth_year,
-            "gender" : self.gender,
-
-      
-            #serializacion de la tabla planets
-            "id" : self.id,
-            "planet_name" : self.planet_name,
-            "rotation_period" : self.rotation_period,
-            "orbital_period" : self.orbital_period,
-            "diameter" : self.diameter,
-            "climate" : self.climate,
-            "gravity" : self.gravity,
-            "terrain"  : self.terrain,
-            "surface_water" : self.surface_water,
-            "population" : self.population,
-            
-            #serializacion de la tabla favorites_planets
-            "id" : self.id,
-            'user_id' : self.user_id,
-            "planet_fav_id" : self.planet_fav_id,
-            
-             #serializacion de la tabla favorites_planets
-            "id" : self.id,
-            'user_id' : self.user_id,
-            "char_fav_id" : self.char_fav_id,
-            
-        }
\ No newline at end of file
+        return serializer_for(Favorites_People).dump(self)
+
+
+# columnas de texto que tienen copia numerica (<columna>_num)
+NUMERIC_FIELDS = {
+    People: ('height', 'mass'),
+    Planets: ('rotation_period', 'orbital_period', 'diameter', 'surface_water', 'population'),
+}
+
+def parse_number(raw):
+    # SWAPI guarda numeros como texto: "1,000", "unknown", "n/a"; lo que no es numero queda en NULL
+    try:
+        value = float(str(raw).replace(',', '').strip())
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) else None
+
+def numeric_values(model, values):
+    return {name + '_num': parse_number(values.get(name)) for name in NUMERIC_FIELDS[model]}
+
+def _fill_numeric_columns(mapper, connection, target):
+    for name in NUMERIC_FIELDS[type(target)]:
+        setattr(target, name + '_num', parse_number(getattr(target, name)))
+
+for _model in NUMERIC_FIELDS:
+    event.listen(_model, 'before_insert', _fill_numeric_columns)
+    event.listen(_model, 'before_update', _fill_numeric_columns)
+
+
+# busqueda por nombre en postgres: indices de trigramas (prefijo, ILIKE y similitud)
+TRIGRAM_INDEXES = (
+    ('ix_people_name_trgm', 'people', 'name'),
+    ('ix_planets_planet_name_trgm', 'planets', 'planet_name'),
+)
+
+for _index, _table, _column in TRIGRAM_INDEXES:
+    event.listen(
+        db.metadata.tables[_table], 'after_create',
+        db.DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm; CREATE INDEX %s ON %s USING gin (%s gin_trgm_ops)' % (_index, _table, _column))
+        .execute_if(dialect='postgresql'),
+    )
+
+
+class Table_Version(db.Model):
+    # un contador por tabla que se incrementa en la misma transaccion que la modifica;
+    # sirve de validador barato (ETag / Last-Modified) sin tener que leer la tabla
+    __tablename__ = 'table_version'
+    name = db.Column(db.String(80), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return '<Table_Version %r %r>' % (self.name, self.version)
+
+#'favorites' versiona las dos tablas de favoritos juntas
+VERSIONED_TABLES = ('people', 'planets', 'user', 'favorites')
+
+@event.listens_for(Table_Version.__table__, 'after_create')
+def _seed_table_versions(target, connection, **kw):
+    connection.execute(target.insert(), [{'name': name, 'version': 0, 'updated_at': datetime.utcnow()} for name in VERSIONED_TABLES])
+
+
+class Serializer:
+    """Public JSON shape of a model.
+
+    `dump` works on ORM instances and on the Row tuples returned by `select`, so
+    read endpoints can project only the columns they need instead of loading
+    whole entities into the identity map.
+    """
+
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = tuple(fields)
+
+    def parse_fields(self, raw):
+        # ?fields=name,gender -> ('id', 'name', 'gender'); the id is always returned
+        if not raw:
+            return self.fields
+        requested = [name.strip() for name in raw.split(',') if name.strip()]
+        unknown = [name for name in requested if name not in self.fields]
+        if unknown:
+            raise APIException('unknown fields: ' + ', '.join(unknown), status_code=400)
+        return ('id',) + tuple(name for name in self.fields if name in requested and name != 'id')
+
+    def columns(self, fields=None):
+        return [getattr(self.model, name) for name in (fields or self.fields)]
+
+    def select(self, fields=None):
+        return db.select(*self.columns(fields))
+
+    def dump(self, obj, fields=None):
+        return {name: getattr(obj, name) for name in (fields or self.fields)}
+
+
+SERIALIZERS = {}
+
+def register_serializer(model, *fields):
+    SERIALIZERS[model] = Serializer(model, fields)
+    return SERIALIZERS[model]
+
+def serializer_for(model):
+    return SERIALIZERS[model]
+
+
+# la clave password (y el email) nunca salen por la API
+register_serializer(User, 'id', 'user_name')
+register_serializer(People, 'id', 'name', 'eye_color', 'skin_color', 'height', 'hair_color', 'birth_year', 'gender', 'mass')
+register_serializer(Planets, 'id', 'planet_name', 'rotation_period', 'orbital_period', 'diameter', 'climate', 'gravity', 'terrain', 'surface_water', 'population')
+register_serializer(Favorites_Planets, 'id', 'user_id', 'planet_fav_id')
+register_serializer(Favorites_People, 'id', 'user_id', 'char_fav_id')
@@ -0,0 +1,180 @@
+"""
+Per request metrics: count, latency and size of every route plus the SQL it ran,
+and an opt-in profiler for sampled (or explicitly requested) requests
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import time
+from flask import current_app, g, has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import metrics
+
+# fraction of requests that record every statement (0 disables sampling)
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+# requests sending `X-Debug-Profile: <PROFILE_TOKEN>` are always profiled
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')
+PROFILE_HEADER = 'X-Debug-Profile'
+# also run cProfile on profiled requests
+PROFILE_CPROFILE = os.getenv('PROFILE_CPROFILE') == '1'
+# requests slower than this are logged as one JSON line
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', 500))
+# add Server-Timing to every response, not only to profiled ones
+SERVER_TIMING = os.getenv('SERVER_TIMING') == '1'
+
+REQUESTS = metrics.Counter('http_requests_total', 'Requests served', ('endpoint', 'method', 'status'))
+LATENCY = metrics.Histogram('http_request_duration_seconds', 'Time to build the response', ('endpoint', 'method'))
+RESPONSE_SIZE = metrics.Histogram(
+    'http_response_size_bytes', 'Size of the response body', ('endpoint',),
+    buckets=(100, 1000, 10000, 100000, 1000000, 10000000),
+)
+STATEMENTS = metrics.Histogram(
+    'db_statements_per_request', 'SQL statements executed by one request', ('endpoint',),
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 500),
+)
+STATEMENTS_TOTAL = metrics.Counter('db_statements_total', 'SQL statements executed', ('endpoint',))
+DB_TIME = metrics.Histogram('db_request_duration_seconds', 'Time spent in the database by one request', ('endpoint',))
+
+
+def _record_statement(context, statement, error=None):
+    # the start time lives on the execution context, which ends with the statement
+    # whether it succeeds or fails, so nothing piles up on the pooled connection
+    start = getattr(context, 'query_start', None)
+    if start is None:
+        return
+    del context.query_start
+    elapsed = time.perf_counter() - start
+    if has_request_context() and 'db_statements' in g:
+        g.db_statements += 1
+        g.db_time += elapsed
+        if g.profile is not None:
+            entry = {'sql': statement, 'ms': round(elapsed * 1000, 3)}
+            if error is not None:
+                entry['error'] = type(error).__name__
+            g.profile['statements'].append(entry)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.query_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _record_statement(context, statement)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(exception_context):
+    # a failed statement (an IntegrityError turned into a 409...) still took its time
+    _record_statement(exception_context.execution_context, exception_context.statement,
+                      exception_context.original_exception)
+
+
+def record_serialize_time(start):
+    if has_request_context() and 'serialize_time' in g:
+        g.serialize_time += time.perf_counter() - start
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Default JSON provider that adds the time spent serializing to the request."""
+
+    def dumps(self, obj, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            record_serialize_time(start)
+
+
+def endpoint_label():
+    # the route template keeps the label set small (/people/<int:char_id>, not /people/3)
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def wants_profile():
+    if PROFILE_TOKEN and request.headers.get(PROFILE_HEADER) == PROFILE_TOKEN:
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def server_timing(total):
+    db_ms = g.db_time * 1000
+    serialize_ms = g.serialize_time * 1000
+    return 'db;dur=%.2f, serialize;dur=%.2f, app;dur=%.2f, total;dur=%.2f' % (
+        db_ms, serialize_ms, max(total * 1000 - db_ms - serialize_ms, 0), total * 1000)
+
+
+def profile_report(profiler, limit=25):
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(limit)
+    return out.getvalue()
+
+
+def log_request(response, total, profile):
+    record = {
+        'event': 'slow_request' if total * 1000 >= SLOW_REQUEST_MS else 'profiled_request',
+        'method': request.method,
+        'path': request.full_path.rstrip('?'),
+        'endpoint': endpoint_label(),
+        'status': response.status_code,
+        'total_ms': round(total * 1000, 2),
+        'db_ms': round(g.db_time * 1000, 2),
+        'serialize_ms': round(g.serialize_time * 1000, 2),
+        'statements': g.db_statements,
+    }
+    if profile is not None:
+        record['sql'] = profile['statements']
+        if profile['profiler'] is not None:
+            record['profile'] = profile_report(profile['profiler'])
+    current_app.logger.warning(json.dumps(record))
+
+
+def init_app(app):
+    # a provider chosen by the app (it should subclass TimedJSONProvider) is kept
+    if not isinstance(app.json, TimedJSONProvider):
+        app.json = TimedJSONProvider(app)
+
+    @app.before_request
+    def start_request_metrics():
+        g.request_start = time.perf_counter()
+        g.db_statements = 0
+        g.db_time = 0.0
+        g.serialize_time = 0.0
+        g.profile = None
+        if wants_profile():
+            g.profile = {'statements': [], 'profiler': None}
+            if PROFILE_CPROFILE:
+                g.profile['profiler'] = cProfile.Profile()
+                g.profile['profiler'].enable()
+
+    @app.after_request
+    def record_request_metrics(response):
+        if 'request_start' not in g:
+            return response
+        total = time.perf_counter() - g.request_start
+        profile = g.profile
+        if profile is not None and profile['profiler'] is not None:
+            profile['profiler'].disable()
+
+        endpoint = endpoint_label()
+        LATENCY.observe(total, endpoint=endpoint, method=request.method)
+        REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        if not response.is_streamed:
+            RESPONSE_SIZE.observe(response.calculate_content_length() or 0, endpoint=endpoint)
+        STATEMENTS.observe(g.db_statements, endpoint=endpoint)
+        STATEMENTS_TOTAL.inc(g.db_statements, endpoint=endpoint)
+        DB_TIME.observe(g.db_time, endpoint=endpoint)
+        metrics.flush()
+
+        if profile is not None or total * 1000 >= SLOW_REQUEST_MS:
+            log_request(response, total, profile)
+        if profile is not None or SERVER_TIMING:
+            response.headers['Server-Timing'] = server_timing(total)
+        return response
@@ -0,0 +1,50 @@
+"""
+Multi-get of people and planets by id: a whole id list is answered with
+`WHERE id IN (...)`, split in chunks so a long list stays under the bound
+parameter limits of the drivers.
+"""
+from bulk import chunked
+from utils import APIException
+
+MAX_IDS = 1000
+# SQLite builds before 3.32 accept at most 999 bound parameters per statement
+IDS_CHUNK_SIZE = 500
+
+
+def parse_ids(raw):
+    """'1,5,9' or [1, 5, 9] -> [1, 5, 9], duplicates dropped, order kept."""
+    if isinstance(raw, str):
+        try:
+            raw = [int(value) for value in raw.split(',') if value.strip()]
+        except ValueError:
+            raise APIException('ids must be a comma separated list of integers', status_code=400)
+    if not isinstance(raw, list) or not all(isinstance(value, int) and not isinstance(value, bool) for value in raw):
+        raise APIException('ids must be a list of integers', status_code=400)
+    ids = list(dict.fromkeys(raw))
+    if len(ids) > MAX_IDS:
+        raise APIException('at most %d ids per request' % MAX_IDS, status_code=400)
+    return ids
+
+
+def body_ids(body):
+    # POST bodies: [1, 5, 9] or {"ids": [1, 5, 9]}
+    if isinstance(body, dict):
+        body = body.get('ids')
+    if not isinstance(body, list):
+        raise APIException('ids must be a list of integers', status_code=400)
+    return parse_ids(body)
+
+
+def multi_get_statements(model, serializer, fields, ids):
+    """One SELECT per chunk of ids; the caller runs them on its own session."""
+    for chunk in chunked(ids, IDS_CHUNK_SIZE):
+        yield serializer.select(fields).where(model.id.in_(chunk))
+
+
+def multi_get_body(rows, ids, dump):
+    """Rows in the order the ids were asked for, plus the ids that don't exist."""
+    found = {row.id: row for row in rows}
+    return {
+        'results': [dump(found[item_id]) for item_id in ids if item_id in found],
+        'missing': [item_id for item_id in ids if item_id not in found],
+    }
@@ -0,0 +1,141 @@
+import base64
+import json
+import math
+from flask import Response, request, stream_with_context
+from sqlalchemy import and_, or_
+from json_provider import dumps_bytes
+from models import db
+from utils import APIException
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+STREAM_CHUNK_SIZE = 1000
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        return json.loads(raw)
+    except (ValueError, TypeError):
+        raise APIException('invalid cursor', status_code=400)
+
+
+def page_size(args=None):
+    limit = (request.args if args is None else args).get('limit', DEFAULT_PAGE_SIZE)
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise APIException('limit must be an integer', status_code=400)
+    if limit < 1:
+        raise APIException('limit must be greater than 0', status_code=400)
+    # the cap is enforced server side whatever the client asks for
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def sort_order(column, descending, with_nulls=True):
+    # NULLs ("unknown") go last in both directions; `IS NULL` sorts the same everywhere.
+    # Without NULLs to place, the (column, id) index alone gives the order
+    return ([column.is_(None)] if with_nulls else []) + [column.desc() if descending else column]
+
+
+def _is_number(value, types=(int, float)):
+    # JSON true/false decode to bool, a subclass of int; json.loads also reads NaN and Infinity
+    return isinstance(value, types) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def read_cursor(args, sort=None):
+    """The validated ?cursor= of a page: the last id, or [sort value, id] when sorted."""
+    after = decode_cursor(args.get('cursor'))
+    if after is None:
+        return None
+    if sort is None:
+        if not _is_number(after, int):
+            raise APIException('invalid cursor', status_code=400)
+        return after
+    # the sort columns are numeric: [number or null, id]
+    if not (isinstance(after, list) and len(after) == 2 and _is_number(after[1], int)
+            and (after[0] is None or _is_number(after[0]))):
+        raise APIException('invalid cursor', status_code=400)
+    return after
+
+
+def page_query(stmt, key, args, sort=None):
+    """`stmt` restricted to the page asked for in `args`, plus the page size.
+
+    With `sort=(column, descending, with_nulls)` rows are ordered by that column
+    and then by `key` in the same direction, and the cursor carries both values
+    of the last row.
+    """
+    limit = page_size(args)
+    after = read_cursor(args, sort)
+    if sort is None:
+        if after is not None:
+            stmt = stmt.where(key > after)
+        return stmt.order_by(key).limit(limit + 1), limit
+
+    column, descending, with_nulls = sort
+    stmt = stmt.add_columns(column.label('sort_value'))
+    if after is not None:
+        value, last = after
+        next_key = key < last if descending else key > last
+        if value is None:
+            stmt = stmt.where(column.is_(None), next_key)
+        else:
+            beyond = column < value if descending else column > value
+            stmt = stmt.where(or_(column.is_(None), beyond, and_(column == value, next_key)))
+    order = sort_order(column, descending, with_nulls) + [key.desc() if descending else key]
+    return stmt.order_by(*order).limit(limit + 1), limit
+
+
+def page_body(rows, key, limit, serializer, sort=None):
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor([last.sort_value, getattr(last, key.key)] if sort else getattr(last, key.key))
+
+    return {
+        'results': [serializer(row) for row in rows],
+        'next': next_cursor,
+    }
+
+
+def paginate(stmt, key, serializer, sort=None):
+    """Keyset pagination over a unique, ordered column (the primary key).
+
+    Pages are fetched with `WHERE key > :last ORDER BY key LIMIT n + 1`, so the
+    cost of a page never depends on how deep into the table the client is.
+    """
+    stmt, limit = page_query(stmt, key, request.args, sort)
+    return page_body(db.session.execute(stmt).all(), key, limit, serializer, sort)
+
+
+def wants_stream(req=None):
+    # the client opts in either with ?stream=1 or by asking for NDJSON explicitly
+    req = request if req is None else req
+    if req.args.get('stream') in ('1', 'true'):
+        return True
+    accept = req.accept_mimetypes
+    return accept[NDJSON_MIMETYPE] > accept['application/json']
+
+
+def ndjson_response(stmt, key, serializer):
+    # stream_results makes the driver use a server side cursor, so only one chunk
+    # of rows is alive at a time and the worker memory stays flat
+    stmt = stmt.order_by(key).execution_options(stream_results=True)
+
+    def generate():
+        rows = db.session.execute(stmt).yield_per(STREAM_CHUNK_SIZE)
+        for row in rows:
+            yield dumps_bytes(serializer(row)) + b'\n'
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
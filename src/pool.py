@@ -0,0 +1,105 @@
+"""
+Engine/pool options taken from the environment, plus pool health metrics
+"""
+import os
+import time
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+from metrics import Counter, Gauge, Histogram
+
+POOL_WAIT = Histogram(
+    'db_pool_wait_seconds', 'Time spent waiting for a connection from the pool',
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0),
+)
+POOL_TIMEOUTS = Counter('db_pool_timeouts_total', 'Checkouts that gave up after pool_timeout')
+
+_pools = []
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that measures how long every checkout waits for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        _pools.append(self)
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            POOL_WAIT.observe(time.perf_counter() - start)
+
+    def recreate(self):
+        # dispose() replaces the pool; only the live one is reported
+        new_pool = super().recreate()
+        if self in _pools:
+            _pools.remove(self)
+        return new_pool
+
+
+def _pool_gauge(read):
+    return lambda: read(_pools[-1]) if _pools else None
+
+
+Gauge('db_pool_size', 'Configured number of persistent connections', function=_pool_gauge(lambda pool: pool.size()))
+Gauge('db_pool_checked_out', 'Connections currently in use', function=_pool_gauge(lambda pool: pool.checkedout()))
+Gauge('db_pool_checked_in', 'Idle connections in the pool', function=_pool_gauge(lambda pool: pool.checkedin()))
+Gauge('db_pool_overflow', 'Connections opened above pool_size', function=_pool_gauge(lambda pool: max(pool.overflow(), 0)))
+
+
+def _env_int(name, default):
+    return int(os.getenv(name, default))
+
+
+def engine_options(url):
+    """SQLALCHEMY_ENGINE_OPTIONS for `url`.
+
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT (seconds), DB_POOL_RECYCLE
+    (seconds), DB_POOL_PRE_PING (0/1) and DB_STATEMENT_TIMEOUT_MS size the pool
+    so `workers * (pool_size + max_overflow)` fits the database connection budget.
+    """
+    if url.startswith('sqlite'):
+        # SQLite files don't use a connection pool worth sizing
+        return {}
+
+    options = {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': _env_int('DB_POOL_SIZE', 5),
+        'max_overflow': _env_int('DB_MAX_OVERFLOW', 10),
+        'pool_timeout': _env_int('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': _env_int('DB_POOL_RECYCLE', 1800),
+        # checks the connection before handing it out, so a failover doesn't
+        # surface as errors on the first request of every stale connection
+        'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', '1') == '1',
+    }
+
+    statement_timeout = _env_int('DB_STATEMENT_TIMEOUT_MS', 0)
+    if statement_timeout:
+        if url.startswith('postgresql'):
+            options['connect_args'] = {'options': '-c statement_timeout=%d' % statement_timeout}
+        elif url.startswith('mysql'):
+            options['connect_args'] = {'init_command': 'SET SESSION MAX_EXECUTION_TIME=%d' % statement_timeout}
+    return options
+
+
+def async_engine_options(url):
+    """Options for create_async_engine(url), sized by the same variables.
+
+    The async engine picks its own (asyncio aware) pool class, and the drivers
+    take the statement timeout under different connect arguments.
+    """
+    options = engine_options(url)
+    options.pop('poolclass', None)
+    options.pop('connect_args', None)
+
+    statement_timeout = _env_int('DB_STATEMENT_TIMEOUT_MS', 0)
+    if statement_timeout:
+        if url.startswith('postgresql'):
+            options['connect_args'] = {'server_settings': {'statement_timeout': str(statement_timeout)}}
+        elif url.startswith('mysql'):
+            options['connect_args'] = {'init_command': 'SET SESSION MAX_EXECUTION_TIME=%d' % statement_timeout}
+    return options
@@ -0,0 +1,108 @@
+"""
+Favorite counters on people and planets: kept up to date by every favorites
+write, read back as a top-K leaderboard, and recomputed by a periodic job
+
+The job is `flask reconcile-popularity`, run hourly by the cron service in
+render.yaml. Counters only drift when favorites change without going through
+the counted paths (SQL by hand, a database cascade, an admin edit moving a
+favorite to another item), so a leaderboard is off for at most an hour after
+such a change.
+"""
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event, func, select, update
+from changes import mark_changed
+import catalogue
+from models import db, People, Planets, Favorites_People, Favorites_Planets, serializer_for
+
+# favorites model -> (item model, favorites column pointing to the item)
+COUNTED = {
+    Favorites_People: (People, Favorites_People.char_fav_id),
+    Favorites_Planets: (Planets, Favorites_Planets.planet_fav_id),
+}
+
+
+def count_change(model, item_ids, delta):
+    """UPDATE adding `delta` to the counter of `item_ids`, to run in the same
+    transaction as the favorites write it accounts for."""
+    if isinstance(item_ids, int):
+        item_ids = [item_ids]
+    return (
+        update(model)
+        .where(model.id.in_(item_ids))
+        .values(favorite_count=model.favorite_count + delta)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _count_entity(delta):
+    # favorites written through the ORM (the admin) go through the mapper events
+    def listener(mapper, connection, target):
+        model, column = COUNTED[type(target)]
+        connection.execute(count_change(model, getattr(target, column.key), delta))
+    return listener
+
+
+for _favorites in COUNTED:
+    event.listen(_favorites, 'after_insert', _count_entity(1))
+    event.listen(_favorites, 'after_delete', _count_entity(-1))
+
+
+def top(model, limit):
+    """The `limit` most favorited rows, read from the (favorite_count, id) index."""
+    serializer = serializer_for(model)
+    snapshot = catalogue.snapshot(model)
+    if snapshot is not None:
+        # the counters move with every favorite, not with the table version: the ranking
+        # stays in the database and only the rows come from the preloaded copy
+        ranking = db.session.execute(
+            select(model.id, model.favorite_count)
+            .where(model.favorite_count > 0)
+            .order_by(model.favorite_count.desc(), model.id.desc())
+            .limit(limit)
+        )
+        return [dict(serializer.dump(snapshot.get(item_id)), favorite_count=count)
+                for item_id, count in ranking if snapshot.get(item_id) is not None]
+    stmt = (
+        serializer.select()
+        .add_columns(model.favorite_count)
+        .where(model.favorite_count > 0)
+        .order_by(model.favorite_count.desc(), model.id.desc())
+        .limit(limit)
+    )
+    return [dict(serializer.dump(row), favorite_count=row.favorite_count) for row in db.session.execute(stmt)]
+
+
+def reconcile(connection):
+    """Recompute every counter from the favorites tables; returns the rows fixed.
+
+    Only rows whose counter drifted are written, so a run on a healthy
+    database doesn't touch anything.
+    """
+    fixed = 0
+    for favorites, (model, column) in COUNTED.items():
+        actual = select(func.count()).where(column == model.id).scalar_subquery()
+        result = connection.execute(
+            update(model)
+            .where(model.favorite_count != actual)
+            .values(favorite_count=actual)
+            .execution_options(synchronize_session=False)
+        )
+        fixed += result.rowcount
+    return fixed
+
+
+@click.command('reconcile-popularity')
+@with_appcontext
+def reconcile_command():
+    """Recompute the favorite counters (hourly, from the cron job in render.yaml)."""
+    fixed = reconcile(db.session.connection())
+    if fixed:
+        # the leaderboards are cached under the favorites version
+        mark_changed(db.session, 'favorites', None)
+    db.session.commit()
+    click.echo('%d counters fixed' % fixed)
+
+
+def init_app(app):
+    app.cli.add_command(reconcile_command)
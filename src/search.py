@@ -0,0 +1,228 @@
+"""
+Facet filters, numeric ranges and sorting, name search (prefix or fuzzy) and
+facet counts for people and planets.
+
+Postgres answers with pg_trgm indexes; other databases use an in-memory
+inverted index per worker, rebuilt whenever the table version moves.
+"""
+import bisect
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+from sqlalchemy import func, select
+from models import db, People, Planets, Table_Version, NUMERIC_FIELDS, serializer_for
+from pagination import page_size
+from utils import APIException
+
+FACETS = {
+    'people': ('gender', 'eye_color', 'hair_color', 'skin_color'),
+    'planets': ('climate', 'terrain'),
+}
+NAMES = {'people': People.name, 'planets': Planets.planet_name}
+MODELS = {'people': People, 'planets': Planets}
+
+# same default as pg_trgm.similarity_threshold
+SIMILARITY = 0.3
+
+
+def facet_values(args, fields):
+    # ?gender=male&eye_color=blue,red -> {'gender': ['male'], 'eye_color': ['blue', 'red']}
+    filters = {}
+    for field in fields:
+        raw = args.get(field)
+        if raw:
+            filters[field] = [value.strip() for value in raw.split(',') if value.strip()]
+    return filters
+
+
+def facet_filters(model, args):
+    """WHERE clauses for the facet parameters of a list endpoint."""
+    filters = facet_values(args, FACETS[model.__tablename__])
+    return [getattr(model, field).in_(values) for field, values in filters.items()]
+
+
+def numeric_bounds(model, args):
+    """?min_height=150&max_mass=80 -> [('height', 'min_', 150.0), ('mass', 'max_', 80.0)]"""
+    bounds = []
+    for field in NUMERIC_FIELDS[model]:
+        for prefix in ('min_', 'max_'):
+            raw = args.get(prefix + field)
+            if raw is None:
+                continue
+            try:
+                value = float(raw)
+            except ValueError:
+                value = None
+            # float() also reads 'nan' and 'inf'
+            if value is None or not math.isfinite(value):
+                raise APIException('%s%s must be a number' % (prefix, field), status_code=400)
+            bounds.append((field, prefix, value))
+    return bounds
+
+
+def numeric_filters(model, args):
+    """WHERE clauses for ?min_height=150&max_mass=80 on the numeric copies."""
+    clauses = []
+    for field, prefix, value in numeric_bounds(model, args):
+        column = getattr(model, field + '_num')
+        clauses.append(column >= value if prefix == 'min_' else column <= value)
+    return clauses
+
+
+def sort_param(model, args):
+    """?sort=height (or -height) -> (height_num column, descending, with_nulls).
+
+    A min_/max_ bound on the same field already leaves the NULLs out.
+    """
+    raw = args.get('sort')
+    if not raw:
+        return None
+    descending = raw.startswith('-')
+    field = raw.lstrip('-')
+    if field not in NUMERIC_FIELDS[model]:
+        raise APIException('sort must be one of: ' + ', '.join(NUMERIC_FIELDS[model]), status_code=400)
+    with_nulls = args.get('min_' + field) is None and args.get('max_' + field) is None
+    return getattr(model, field + '_num'), descending, with_nulls
+
+
+def list_filters(model, args):
+    return facet_filters(model, args) + numeric_filters(model, args)
+
+
+def trigrams(text):
+    # words padded like pg_trgm does, so both backends rank names alike
+    grams = set()
+    for word in re.findall(r'\w+', text.lower()):
+        word = '  ' + word + ' '
+        grams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return grams
+
+
+class InvertedIndex:
+    """Names, trigrams and facet values of one table, held by each worker."""
+
+    def __init__(self, table):
+        self.table = table
+        self.version = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        current = db.session.get(Table_Version, self.table)
+        current = current.version if current is not None else None
+        if current == self.version and current is not None:
+            return
+        with self._lock:
+            if current != self.version or current is None:
+                self._build()
+                self.version = current
+
+    def _build(self):
+        model, name, fields = MODELS[self.table], NAMES[self.table], FACETS[self.table]
+        columns = [model.id, name] + [getattr(model, field) for field in fields]
+        names, postings, facets, records = [], defaultdict(set), {field: defaultdict(set) for field in fields}, {}
+        for row in db.session.execute(select(*columns)):
+            item_id, item_name, values = row[0], row[1].lower(), dict(zip(fields, row[2:]))
+            grams = trigrams(item_name)
+            names.append((item_name, item_id))
+            for gram in grams:
+                postings[gram].add(item_id)
+            for field, value in values.items():
+                facets[field][value].add(item_id)
+            records[item_id] = (len(grams), values)
+        names.sort()
+        # swapped in one go, so a concurrent search sees the old or the new index
+        self._state = (names, postings, facets, records)
+
+    def search(self, q, filters, limit):
+        names, postings, facets, records = self._state
+
+        if q:
+            q = q.lower()
+            start = bisect.bisect_left(names, (q,))
+            prefix = set()
+            for item_name, item_id in names[start:]:
+                if not item_name.startswith(q):
+                    break
+                prefix.add(item_id)
+            grams = trigrams(q)
+            shared = Counter()
+            for gram in grams:
+                shared.update(postings.get(gram, ()))
+            scores = {item_id: count / (len(grams) + records[item_id][0] - count) for item_id, count in shared.items()}
+            matched = prefix | {item_id for item_id, score in scores.items() if score >= SIMILARITY}
+        else:
+            prefix, scores, matched = set(), {}, set(records)
+
+        for field, values in filters.items():
+            allowed = set()
+            for value in values:
+                allowed |= facets[field].get(value, set())
+            matched &= allowed
+
+        ranked = sorted(matched, key=lambda item_id: (item_id not in prefix, -scores.get(item_id, 0), item_id))
+        counts = {field: dict(Counter(records[item_id][1][field] for item_id in matched)) for field in facets}
+        return ranked[:limit], len(matched), counts
+
+
+_indexes = {table: InvertedIndex(table) for table in MODELS}
+
+
+def search_postgres(table, q, filters, limit):
+    model, name = MODELS[table], NAMES[table]
+    where = [getattr(model, field).in_(values) for field, values in filters.items()]
+    order = [model.id]
+    if q:
+        # both predicates are served by the gin_trgm_ops index on the name
+        prefix = name.ilike(q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+        where.append(prefix | name.op('%')(q))
+        order = [prefix.desc(), func.similarity(name, q).desc(), model.id]
+
+    ids = db.session.scalars(select(model.id).where(*where).order_by(*order).limit(limit)).all()
+    total = db.session.scalar(select(func.count()).select_from(model).where(*where))
+    counts = {}
+    for field in FACETS[table]:
+        column = getattr(model, field)
+        counts[field] = dict(db.session.execute(select(column, func.count()).where(*where).group_by(column)).all())
+    return ids, total, counts
+
+
+def search_table(table, q, filters, limit):
+    if db.session.get_bind().dialect.name == 'postgresql':
+        ids, total, counts = search_postgres(table, q, filters, limit)
+    else:
+        index = _indexes[table]
+        index.refresh()
+        ids, total, counts = index.search(q, filters, limit)
+
+    serializer = serializer_for(MODELS[table])
+    # imported here: catalogue reads its filters from this module
+    import catalogue
+    snapshot = catalogue.snapshot(MODELS[table])
+    if snapshot is not None:
+        rows = {row.id: row for row in snapshot.get_many(ids)}
+    else:
+        rows = {row.id: row for row in db.session.execute(serializer.select().where(MODELS[table].id.in_(ids)))} if ids else {}
+    return {
+        'results': [serializer.dump(rows[item_id]) for item_id in ids if item_id in rows],
+        'total': total,
+        'facets': counts,
+    }
+
+
+def search(args):
+    """GET /search?q=sky&type=people&gender=male -> {type: {results, total, facets}}"""
+    types = [name.strip() for name in args.get('type', 'people,planets').split(',') if name.strip()]
+    unknown = [name for name in types if name not in MODELS]
+    if unknown:
+        raise APIException('unknown type: ' + ', '.join(unknown), status_code=400)
+
+    filters = facet_values(args, {field for table in types for field in FACETS[table]})
+    # a type is only searched when it has every facet that was filtered on
+    types = [table for table in types if set(filters) <= set(FACETS[table])]
+    if not types:
+        raise APIException('no type has all of these filters: ' + ', '.join(filters), status_code=400)
+
+    q = args.get('q', '').strip()
+    limit = page_size(args)
+    return {table: search_table(table, q, filters, limit) for table in types}
@@ -1,4 +1,10 @@
-from flask import jsonify, url_for
+import hashlib
+import re
+import threading
+from flask import Response, current_app, jsonify, request, url_for
+
+# <int:char_id> -> ('int', 'char_id'), <name> -> ('', 'name')
+RULE_PARAM = re.compile(r'<(?:(\w+)(?:\([^)]*\))?:)?(\w+)>')
 
 class APIException(Exception):
     status_code = 400
@@ -15,13 +21,34 @@ class APIException(Exception):
         rv['message'] = self.message
         return rv
 
+class LazyMount:
+    """WSGI middleware: requests under `prefix` go to the app that `factory()`
+    builds on the first of them, every other request to `wsgi_app`."""
+
+    def __init__(self, wsgi_app, prefix, factory):
+        self.wsgi_app = wsgi_app
+        self.prefix = prefix
+        self.factory = factory
+        self._app = None
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if path != self.prefix and not path.startswith(self.prefix + '/'):
+            return self.wsgi_app(environ, start_response)
+        if self._app is None:
+            with self._lock:
+                if self._app is None:
+                    self._app = self.factory()
+        return self._app(environ, start_response)
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()
     return len(defaults) >= len(arguments)
 
 def generate_sitemap(app):
-    links = ['/admin/']
+    links = ['/admin/'] if app.config.get('ADMIN_UI') else []
     for rule in app.url_map.iter_rules():
         # Filter out rules we can't navigate to in a browser
         # and rules that require parameters
@@ -39,3 +66,38 @@ def generate_sitemap(app):
         <p>Start working on your proyect by following the <a href="https://start.4geeksacademy.com/starters/flask" target="_blank">Quick Start</a></p>
         <p>Remember to specify a real endpoint path like: </p>
         <ul style="text-align: left;">"""+links_html+"</ul></div>"
+
+
+def route_table(app):
+    """Methods and path parameters of every API route, for client code generation."""
+    routes = []
+    for rule in app.url_map.iter_rules():
+        if rule.endpoint == 'static' or rule.rule.startswith('/admin'):
+            continue
+        routes.append({
+            'rule': rule.rule,
+            'name': rule.endpoint.rpartition('.')[2],
+            'methods': sorted(rule.methods - {'HEAD', 'OPTIONS'}),
+            'params': [{'name': name, 'type': converter or 'string'} for converter, name in RULE_PARAM.findall(rule.rule)],
+        })
+    return sorted(routes, key=lambda route: (route['rule'], route['methods']))
+
+
+def memoized_response(name, build, mimetype):
+    """Body from `build(app)`, built once per app and served with a strong ETag.
+
+    Only for pages that change with the routes and nothing else, like the sitemap.
+    """
+    app = current_app._get_current_object()
+    bodies = app.extensions.setdefault('memoized_bodies', {})
+    # url_for puts the script root in front of every link
+    key = (name, request.script_root)
+    if key not in bodies:
+        body = build(app)
+        bodies[key] = body, hashlib.sha1(body).hexdigest()[:20]
+    body, digest = bodies[key]
+    response = Response(body, mimetype=mimetype)
+    response.set_etag(digest)
+    # the compression hook keeps the compressed body under this key
+    response.cache_key = 'memoized:%s:%s' % (name, digest)
+    return response.make_conditional(request)
@@ -1,7 +1,14 @@
 # This file was created to run the application on heroku using gunicorn.
 # Read more about it here: https://devcenter.heroku.com/articles/python-gunicorn
 
-from app import app as application
+from app import create_app
+import catalogue
+
+application = create_app()
+
+# with CATALOGUE_PRELOAD=1 and gunicorn --preload the catalogue is loaded once,
+# before forking, and the workers share it
+catalogue.preload(application)
 
 if __name__ == "__main__":
     application.run()
@@ -0,0 +1,50 @@
+"""
+The admin UI is mounted at /admin and only built by the first request to it.
+"""
+import pytest
+import cache
+from app import create_app
+from models import db
+from utils import LazyMount
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'backend', cache.MemoryBackend())
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///%s' % (tmp_path / 'admin.db'),
+        'ADMIN_UI': True,
+        'TESTING': True,
+    })
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def test_admin_is_built_by_the_first_admin_request(app):
+    mount = app.wsgi_app
+    assert isinstance(mount, LazyMount)
+    client = app.test_client()
+
+    assert client.get('/people').status_code == 200
+    assert mount._app is None
+
+    response = client.get('/admin/')
+    assert response.status_code == 200
+    assert b'4Geeks Admin' in response.data
+    built = mount._app
+    assert client.get('/admin/people/').status_code == 200
+    assert mount._app is built
+
+
+def test_only_paths_under_the_prefix_go_to_the_admin(app):
+    client = app.test_client()
+    assert client.get('/administrators').status_code == 404
+    assert app.wsgi_app._app is None
+    assert b'/admin/' in client.get('/').data
+
+
+def test_admin_off(tmp_path):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///%s' % (tmp_path / 'off.db'), 'ADMIN_UI': False})
+    assert not isinstance(app.wsgi_app, LazyMount)
+    assert app.test_client().get('/admin/').status_code == 404
@@ -0,0 +1,152 @@
+"""
+List pages served from the preloaded catalogue must match the ones paginated
+in the database: same rows, same order, same cursors, same errors.
+"""
+import pytest
+import cache
+import catalogue
+from app import create_app
+from models import db, People, Planets
+from utils import APIException
+
+QUERIES = [
+    '',
+    'limit=7',
+    'limit=5&fields=name,gender',
+    'gender=male,n/a&limit=4',
+    'eye_color=blue&hair_color=blond',
+    'min_height=150&limit=6',
+    'min_height=150&max_mass=80',
+    'sort=height&limit=6',
+    'sort=-height&limit=6',
+    'sort=mass&limit=3',
+    'sort=-mass&gender=female&limit=4',
+    'sort=height&min_height=160&limit=5',
+    'sort=-height&max_height=170&fields=name&limit=2',
+    'gender=nobody',
+]
+
+PLANET_QUERIES = [
+    'limit=4',
+    'climate=arid&limit=3',
+    'sort=-population&limit=4',
+    'sort=diameter&min_surface_water=10&limit=3',
+]
+
+
+def person(i):
+    # repeated heights and masses and 'unknown' values exercise ties and NULLs
+    return People(
+        name='person %02d' % i,
+        height=('unknown', '150', '172', '172', '96', '1,200')[i % 6],
+        mass=('77', 'unknown', '80', '45.5', '80', 'n/a', '136')[i % 7],
+        eye_color=('blue', 'brown', 'red')[i % 3],
+        skin_color='fair',
+        hair_color=('blond', 'none', 'black', 'n/a')[i % 4],
+        birth_year='19BBY',
+        gender=('male', 'female', 'n/a')[i % 3],
+    )
+
+
+def planet(i):
+    return Planets(
+        planet_name='planet %02d' % i,
+        rotation_period=str(20 + i % 5),
+        orbital_period=str(300 + i),
+        diameter=('10465', 'unknown', '7200', '0')[i % 4],
+        climate=('arid', 'temperate', 'frozen')[i % 3],
+        gravity='1 standard',
+        terrain=('desert', 'grasslands')[i % 2],
+        surface_water=('1', '40', 'unknown', '12')[i % 4],
+        population=('200000', '1000000000', 'unknown', '200000')[i % 4],
+    )
+
+
+@pytest.fixture(scope='module')
+def app(tmp_path_factory):
+    # a fresh response cache: other test databases start at the same versions
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(cache, 'backend', cache.MemoryBackend())
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///%s' % (tmp_path_factory.mktemp('catalogue') / 'catalogue.db'),
+            'ADMIN_UI': False,
+            'TESTING': True,
+        })
+        with app.app_context():
+            db.create_all()
+            db.session.add_all([person(i) for i in range(1, 41)] + [planet(i) for i in range(1, 25)])
+            db.session.commit()
+        yield app
+
+
+def database_pages(client, path, query):
+    """Every page of `path?query` served from the table (CATALOGUE_PRELOAD is off here)."""
+    pages, url = [], '%s?%s' % (path, query)
+    while True:
+        response = client.get(url)
+        assert response.status_code == 200, response.get_json()
+        body = response.get_json()
+        pages.append(body)
+        if body['next'] is None:
+            return pages
+        url = '%s?%s&cursor=%s' % (path, query, body['next'])
+
+
+def snapshot_pages(app, model, query):
+    serializer = catalogue.stores[model].serializer
+    pages, cursor = [], None
+    while True:
+        url = '/?%s%s' % (query, '&cursor=' + cursor if cursor else '')
+        with app.test_request_context(url) as ctx:
+            snapshot = catalogue.stores[model].snapshot(db.session)
+            fields = serializer.parse_fields(ctx.request.args.get('fields'))
+            body = catalogue.list_page(snapshot, model, ctx.request.args, lambda row: serializer.dump(row, fields))
+        # the same JSON round trip as the response
+        pages.append(app.json.loads(app.json.dumps(body)))
+        if body['next'] is None:
+            return pages
+        cursor = body['next']
+
+
+@pytest.mark.parametrize('query', QUERIES)
+def test_people_pages_match_the_database(app, query):
+    assert snapshot_pages(app, People, query) == database_pages(app.test_client(), '/people', query)
+
+
+@pytest.mark.parametrize('query', PLANET_QUERIES)
+def test_planet_pages_match_the_database(app, query):
+    assert snapshot_pages(app, Planets, query) == database_pages(app.test_client(), '/planets', query)
+
+
+BAD_QUERIES = [
+    'sort=weight',
+    'min_height=tall',
+    'min_height=nan',
+    'max_mass=-inf',
+    'cursor=bm9wZQ',
+    'cursor=SW5maW5pdHk',  # Infinity
+    'sort=height&cursor=WyJhYmMiLDVd',  # ["abc",5]
+    'sort=height&cursor=W05hTiw1XQ',  # [NaN,5]
+]
+
+
+@pytest.mark.parametrize('query', BAD_QUERIES)
+def test_bad_parameters_are_rejected_like_the_database(app, query):
+    response = app.test_client().get('/people?' + query)
+    assert response.status_code == 400
+    with app.test_request_context('/?' + query) as ctx:
+        snapshot = catalogue.stores[People].snapshot(db.session)
+        with pytest.raises(APIException) as error:
+            catalogue.list_page(snapshot, People, ctx.request.args, dict)
+    assert error.value.to_dict() == response.get_json()
+
+
+def test_snapshot_follows_the_table_version(app):
+    with app.app_context():
+        store = catalogue.stores[People]
+        before = store.snapshot(db.session)
+        db.session.add(person(99))
+        db.session.commit()
+        after = store.snapshot(db.session)
+        assert after is not before
+        assert len(after.ids) == len(before.ids) + 1
@@ -0,0 +1,67 @@
+"""
+GET /user/<id>/favorites must cost the same number of statements however many
+favorites the user has: the user, one SELECT per favorites table, and the
+names of the people and planets joined into those.
+"""
+import pytest
+from sqlalchemy import event
+import cache
+from app import create_app
+from models import db, User, People, Planets, Favorites_People, Favorites_Planets
+
+
+def seed(count):
+    user = User(user_name='luke', email='luke@example.com', password='x')
+    db.session.add(user)
+    for i in range(count):
+        person = People(name='person %d' % i, height='172', mass='77', eye_color='blue',
+                        skin_color='fair', hair_color='blond', birth_year='19BBY', gender='male')
+        planet = Planets(planet_name='planet %d' % i, rotation_period='23', orbital_period='304',
+                         diameter='10465', climate='arid', gravity='1', terrain='desert',
+                         surface_water='1', population='200000')
+        db.session.add_all([person, planet])
+        db.session.flush()
+        db.session.add_all([
+            Favorites_People(user_id=user.id, char_fav_id=person.id),
+            Favorites_Planets(user_id=user.id, planet_fav_id=planet.id),
+        ])
+    db.session.commit()
+    return user.id
+
+
+def favorites_statements(tmp_path, count):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///%s' % (tmp_path / ('favorites-%d.db' % count)),
+        'ADMIN_UI': False,
+        'TESTING': True,
+    })
+    with app.app_context():
+        db.create_all()
+        user_id = seed(count)
+        engine = db.engine
+
+    statements = []
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        # the response cache reads one table_version row per scope, that's not the view
+        if 'table_version' not in statement:
+            statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', count_statement)
+    try:
+        response = app.test_client().get('/user/%d/favorites' % user_id)
+    finally:
+        event.remove(engine, 'before_cursor_execute', count_statement)
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert len(body['chars_fav_list']) == count
+    assert len(body['planets_fav_list']) == count
+    return len(statements)
+
+
+@pytest.mark.parametrize('count', [10, 100])
+def test_favorites_statements_do_not_grow_with_favorites(tmp_path, monkeypatch, count):
+    # a fresh response cache: every test database starts at the same versions
+    monkeypatch.setattr(cache, 'backend', cache.MemoryBackend())
+    assert favorites_statements(tmp_path, count) == 3
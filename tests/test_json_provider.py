@@ -0,0 +1,99 @@
+"""
+FastJSONProvider must write the same bytes as Flask's default provider, with
+orjson and with the standard library fallback.
+"""
+import datetime
+import decimal
+import uuid
+import pytest
+from flask.json.provider import DefaultJSONProvider
+import cache
+import json_provider
+from app import create_app
+from models import db, People, Planets, User, Favorites_People
+
+EDGE_CASES = [
+    {},
+    [],
+    {'msg': 'this character not exist :('},
+    {'name': 'Padmé Amidala', 'planet': 'Ach-To', 'emoji': '\U0001F680', 'quote': 'say "hi"\n\t\\'},
+    {'b': 1, 'a': {'d': [1, 2, {'z': None, 'y': True, 'x': False}], 'c': ''}},
+    {'big': 2 ** 70, 'negative': -(2 ** 63), 'zero': 0},
+    {'results': [], 'next': None},
+    {'control': '\x00\x1f\x7f', 'slash': '</script>'},
+    # types left to the provider's `default`
+    {'when': datetime.datetime(2022, 11, 23, 10, 30), 'day': datetime.date(2022, 11, 23)},
+    {'amount': decimal.Decimal('10.50'), 'id': uuid.UUID('12345678-1234-5678-1234-567812345678')},
+]
+
+API_URLS = [
+    '/people?limit=50', '/people?sort=-height', '/planets?limit=50', '/users', '/people/1',
+    '/planets/1', '/people/popular', '/people?ids=2,1,99', '/user/1/favorites', '/people/999',
+]
+
+ENCODERS = [
+    pytest.param(True, id='orjson', marks=pytest.mark.skipif(json_provider.orjson is None, reason='orjson not installed')),
+    pytest.param(False, id='stdlib'),
+]
+
+
+@pytest.fixture(scope='module')
+def app(tmp_path_factory):
+    # a fresh response cache: other test databases start at the same versions
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(cache, 'backend', cache.MemoryBackend())
+        yield build_app(tmp_path_factory)
+
+
+def build_app(tmp_path_factory):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///%s' % (tmp_path_factory.mktemp('json') / 'json.db'),
+        'ADMIN_UI': False,
+        'TESTING': True,
+    })
+    with app.app_context():
+        db.create_all()
+        user = User(user_name='luke', email='luke@example.com', password='x')
+        db.session.add(user)
+        for i, name in enumerate(['Luke Skywalker', 'Padmé Amidala', 'Jar Jar "Binks"', 'Ki-Adi-Mundi é中']):
+            db.session.add(People(name=name, height=str(150 + i), mass='unknown' if i % 2 else '1,358',
+                                  eye_color='blue', skin_color='fair', hair_color='n/a', birth_year='19BBY', gender='male'))
+            db.session.add(Planets(planet_name='Planet %d ñ' % i, rotation_period='23', orbital_period='304',
+                                   diameter='10465', climate='arid, temperate', gravity='1 standard', terrain='desert',
+                                   surface_water='1', population='200000'))
+        db.session.flush()
+        db.session.add(Favorites_People(user_id=user.id, char_fav_id=1))
+        db.session.commit()
+    return app
+
+
+def api_payloads(app):
+    client = app.test_client()
+    return [client.get(url).get_json() for url in API_URLS]
+
+
+@pytest.fixture(params=ENCODERS)
+def fast(request, app, monkeypatch):
+    if not request.param:
+        # the fallback must produce the same bytes as well
+        monkeypatch.setattr(json_provider, 'orjson', None)
+    return json_provider.FastJSONProvider(app)
+
+
+def assert_same_bytes(app, fast, payload):
+    with app.app_context():
+        expected = DefaultJSONProvider(app).response(payload).get_data()
+        assert fast.response(payload).get_data() == expected, ('MISMATCH: %r' % (payload,))[:200]
+        assert fast.dumps(payload, separators=(',', ':')) == DefaultJSONProvider(app).dumps(payload, separators=(',', ':'))
+
+
+@pytest.mark.parametrize('payload', EDGE_CASES)
+def test_edge_cases_match_the_default_provider(app, fast, payload):
+    assert_same_bytes(app, fast, payload)
+
+
+@pytest.mark.parametrize('index', range(len(API_URLS)), ids=API_URLS)
+def test_api_payloads_match_the_default_provider(app, fast, index):
+    payload = api_payloads(app)[index]
+    assert payload is not None
+    assert_same_bytes(app, fast, payload)
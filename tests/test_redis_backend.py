@@ -0,0 +1,155 @@
+"""
+RedisBackend against a small RESP2 server run on daemon threads: framing,
+binary values, error replies and reconnecting after the server drops the
+connection.
+"""
+import socket
+import socketserver
+import threading
+import time
+import pytest
+from cache import RedisBackend
+
+
+class FakeRedis(socketserver.ThreadingTCPServer):
+    """GET, SET [EX seconds], DEL, AUTH and SELECT over RESP2, kept in a dict.
+
+    A key starting with 'error' gets an -ERR reply; `drop()` closes every open
+    connection, like a server restart.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeRedisHandler)
+        self.values = {}
+        self.ttls = {}
+        self.commands = []
+        self.connections = []
+        self.lock = threading.Lock()
+
+    def drop(self):
+        with self.lock:
+            for conn in self.connections:
+                conn.shutdown(socket.SHUT_RDWR)
+                conn.close()
+            self.connections.clear()
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        with self.server.lock:
+            self.server.connections.append(self.request)
+        try:
+            while True:
+                args = self.read_command()
+                if args is None:
+                    return
+                self.wfile.write(self.reply(args))
+        except (OSError, ValueError):
+            return
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        assert line.startswith(b'*')
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def reply(self, args):
+        server = self.server
+        command = args[0].decode().upper()
+        server.commands.append(command)
+        if len(args) > 1 and args[1].startswith(b'error'):
+            return b'-ERR simulated failure\r\n'
+        if command in ('AUTH', 'SELECT'):
+            return b'+OK\r\n'
+        if command == 'SET':
+            key, value = args[1], args[2]
+            server.values[key] = value
+            if len(args) == 5 and args[3].upper() == b'EX':
+                server.ttls[key] = int(args[4])
+            return b'+OK\r\n'
+        if command == 'GET':
+            value = server.values.get(args[1])
+            if value is None:
+                return b'$-1\r\n'
+            return b'$%d\r\n%s\r\n' % (len(value), value)
+        if command == 'DEL':
+            removed = server.values.pop(args[1], None) is not None
+            server.ttls.pop(args[1], None)
+            return b':%d\r\n' % removed
+        return b'-ERR unknown command\r\n'
+
+
+@pytest.fixture
+def server():
+    server = FakeRedis()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def backend(server):
+    return RedisBackend('redis://127.0.0.1:%d/0' % server.server_address[1])
+
+
+def test_set_get_delete(server, backend):
+    assert backend.get('response:a') is None
+    backend.set('response:a', b'{"x":1}', ttl=30)
+    assert backend.get('response:a') == b'{"x":1}'
+    assert server.ttls[b'response:a'] == 30
+
+    backend.delete('response:a')
+    assert backend.get('response:a') is None
+    assert backend.stats() == {'hits': 1, 'misses': 2, 'errors': 0}
+
+
+def test_binary_values_are_kept_byte_for_byte(backend):
+    # compressed bodies: CRLF, NUL and high bytes must survive the bulk string framing
+    value = b'\x1f\x8b\x08\x00\r\n$-1\r\n\x00' + bytes(range(256)) + b'\r\n'
+    backend.set('response:gz', value)
+    assert backend.get('response:gz') == value
+
+
+def test_password_and_database_are_sent_on_connect(server):
+    backend = RedisBackend('redis://:secret@127.0.0.1:%d/2' % server.server_address[1])
+    backend.set('k', b'v')
+    assert server.commands[:3] == ['AUTH', 'SELECT', 'SET']
+
+
+def test_error_reply_is_a_miss(backend):
+    assert backend.get('error:key') is None
+    assert backend.stats()['errors'] == 1
+    # the connection was dropped with the error; the next call opens a new one
+    backend.set('ok', b'1')
+    assert backend.get('ok') == b'1'
+
+
+def test_reconnects_after_the_server_drops_the_connection(server, backend):
+    backend.set('response:a', b'1')
+    server.drop()
+    # the call that finds the connection closed is answered as a miss...
+    assert backend.get('response:a') is None
+    assert backend.stats()['errors'] == 1
+    # ...and the next one reconnects
+    assert backend.get('response:a') == b'1'
+
+
+def test_server_down_is_a_miss():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    backend = RedisBackend('redis://127.0.0.1:%d/0' % port, timeout=0.2)
+    start = time.monotonic()
+    assert backend.get('response:a') is None
+    backend.set('response:a', b'1')
+    assert backend.stats()['errors'] == 2
+    assert time.monotonic() - start < 2